@@ -1,15 +1,44 @@
-import time
 import base64
 import hashlib
+import logging
+import queue
+import threading
 
 from utils.common import Coin, HttpClient, get_rune_asset, Asset
-from utils.segwit_addr import address_from_public_key
+from utils.segwit_addr import address_from_public_key, decode_address
 from chains.aliases import aliases_bnb, get_aliases, get_alias_address
-from chains.chain import GenericChain
+from chains.chain import GenericChain, head_watcher
 
 RUNE = get_rune_asset()
 
 
+def encode_coin(denom, amount):
+    """
+    Amino encoding of a coin as found in a raw tx,
+    the length prefixed denom then the varint amount
+    """
+    varint = bytearray()
+    while amount > 0x7F:
+        varint.append(amount & 0x7F | 0x80)
+        amount >>= 7
+    varint.append(amount)
+    denom = denom.encode()
+    return b"\n" + bytes([len(denom)]) + denom + b"\x10" + bytes(varint)
+
+
+def holds_in_order(raw, parts):
+    """
+    Check if the parts are found one after the other in raw
+    """
+    pos = 0
+    for part in parts:
+        pos = raw.find(part, pos)
+        if pos < 0:
+            return False
+        pos += len(part)
+    return True
+
+
 class MockBinance(HttpClient):
     """
     An client implementation for a mock binance server
@@ -39,19 +68,27 @@ class MockBinance(HttpClient):
         """
         Get the current block tx from height of mock binance
         """
+        return self.get_block_txs(height)[0]
+
+    def get_block_txs(self, height):
+        """
+        Get all the txs (raw, base64 encoded) of a block of mock binance
+        """
         data = self.fetch(f"/block?height={height}")
-        return data["result"]["block"]["data"]["txs"][0]
+        return data["result"]["block"]["data"]["txs"]
+
+    @property
+    def head(self):
+        """
+        Head of the chain, tracked by the shared head watcher
+        """
+        return head_watcher.watch(self.base_url, self.get_block_height)
 
     def wait_for_blocks(self, count):
         """
         Wait for the given number of blocks
         """
-        start_block = self.get_block_height()
-        for x in range(0, 30):
-            time.sleep(1)
-            block = self.get_block_height()
-            if block - start_block >= count:
-                return
+        return self.head.wait_for_blocks(count)
 
     def get_tx_id_from_block(self, height):
         """Get transaction hash ID from a block height.
@@ -79,6 +116,66 @@ class MockBinance(HttpClient):
         """
         return address_from_public_key(pubkey, "tbnb")
 
+    def prepare(self, txn):
+        """
+        Resolve the aliases of a transaction and build its broadcast payload
+        """
+        if not isinstance(txn.coins, list):
+            txn.coins = [txn.coins]
+
+        if txn.to_address in get_aliases():
+            txn.to_address = get_alias_address(txn.chain, txn.to_address)
+
+        if txn.from_address in get_aliases():
+            txn.from_address = get_alias_address(txn.chain, txn.from_address)
+
+        # update memo with actual address (over alias name)
+        for alias in get_aliases():
+            chain = txn.chain
+            asset = txn.get_asset_from_memo()
+            if asset:
+                chain = asset.get_chain()
+            if txn.memo.startswith("STAKE"):
+                if asset and txn.chain == asset.get_chain():
+                    chain = RUNE.get_chain()
+            addr = get_alias_address(chain, alias)
+            txn.memo = txn.memo.replace(alias, addr)
+
+        return {
+            "from": txn.from_address,
+            "to": txn.to_address,
+            "memo": txn.memo,
+            "coins": [coin.to_binance_fmt() for coin in txn.coins],
+        }
+
+    def resolve_ids(self, height, txns):
+        """
+        Set the id of transactions broadcasted in the block at height,
+        with a single fetch of the block.
+
+        The block may hold txs of other broadcasts, so each transaction is
+        matched in order with the next raw tx holding its content in the
+        order of a send: sender and coins, recipient and coins, then memo.
+        """
+        raws = [base64.b64decode(tx) for tx in self.get_block_txs(height)]
+        start = 0
+        for txn in txns:
+            coins = [encode_coin(**coin.to_binance_fmt()) for coin in txn.coins]
+            parts = [
+                decode_address(txn.from_address) or b"",
+                *coins,
+                decode_address(txn.to_address) or b"",
+                *coins,
+                txn.memo.encode(),
+            ]
+            for i in range(start, len(raws)):
+                if holds_in_order(raws[i], parts):
+                    txn.id = hashlib.new("sha256", raws[i]).digest().hex().upper()
+                    start = i + 1
+                    break
+            else:
+                logging.warning(f"BNB tx not found in block {height}: {txn}")
+
     def transfer(self, txns):
         """
         Make a transaction/transfer on mock binance
@@ -86,39 +183,56 @@ class MockBinance(HttpClient):
         if not isinstance(txns, list):
             txns = [txns]
 
-        payload = []
-        for txn in txns:
-            if not isinstance(txn.coins, list):
-                txn.coins = [txn.coins]
-
-            if txn.to_address in get_aliases():
-                txn.to_address = get_alias_address(txn.chain, txn.to_address)
-
-            if txn.from_address in get_aliases():
-                txn.from_address = get_alias_address(txn.chain, txn.from_address)
-
-            # update memo with actual address (over alias name)
-            for alias in get_aliases():
-                chain = txn.chain
-                asset = txn.get_asset_from_memo()
-                if asset:
-                    chain = asset.get_chain()
-                if txn.memo.startswith("STAKE"):
-                    if asset and txn.chain == asset.get_chain():
-                        chain = RUNE.get_chain()
-                addr = get_alias_address(chain, alias)
-                txn.memo = txn.memo.replace(alias, addr)
-
-            payload.append(
-                {
-                    "from": txn.from_address,
-                    "to": txn.to_address,
-                    "memo": txn.memo,
-                    "coins": [coin.to_binance_fmt() for coin in txn.coins],
-                }
-            )
+        payload = [self.prepare(txn) for txn in txns]
         result = self.post("/broadcast/easy", payload)
-        txn.id = self.get_tx_id_from_block(result["height"])
+        self.resolve_ids(result["height"], txns)
+
+    def transfer_bulk(self, txns, chunk_size=100):
+        """
+        Broadcast many transactions in chunks of at most chunk_size,
+        the next chunk is built while the previous one is sent.
+        Then every transaction gets the id of its tx, one fetch per block.
+
+        :returns: dict of the transactions by block height
+        """
+        chunks = queue.Queue(maxsize=2)
+        stopped = threading.Event()
+        errors = []
+
+        def build():
+            try:
+                for i in range(0, len(txns), chunk_size):
+                    if stopped.is_set():
+                        return
+                    chunk = txns[i : i + chunk_size]
+                    chunks.put((chunk, [self.prepare(txn) for txn in chunk]))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                chunks.put(None)
+
+        builder = threading.Thread(target=build, daemon=True)
+        builder.start()
+        blocks = {}
+        try:
+            for chunk, payload in iter(chunks.get, None):
+                result = self.post("/broadcast/easy", payload)
+                blocks.setdefault(int(result["height"]), []).extend(chunk)
+        finally:
+            # unblock the builder if the broadcast failed
+            stopped.set()
+            while builder.is_alive():
+                try:
+                    chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        if errors:
+            raise errors[0]
+
+        for height, block_txns in blocks.items():
+            self.resolve_ids(height, block_txns)
+        logging.info(f"BNB broadcast: {len(txns)} txs | {len(blocks)} blocks")
+        return blocks
 
 
 class Binance(GenericChain):
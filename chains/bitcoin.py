@@ -1,22 +1,143 @@
-import time
 import codecs
 import logging
+import threading
 
 from bitcoin import SelectParams
-from bitcoin.wallet import CBitcoinSecret, P2WPKHBitcoinAddress
-from bitcoin.core import Hash160
+from bitcoin.wallet import CBitcoinAddress, CBitcoinSecret, P2WPKHBitcoinAddress
+from bitcoin.core import (
+    Hash160,
+    CMutableTransaction,
+    COutPoint,
+    CTxIn,
+    CTxOut,
+    b2x,
+    lx,
+)
 from bitcoin.core.script import CScript, OP_0
 from utils.common import Coin, HttpClient, get_rune_asset, Asset
-from decimal import Decimal, getcontext
+from decimal import Decimal
 from chains.aliases import aliases_btc, get_aliases, get_alias_address
-from chains.chain import GenericChain
+from chains.chain import GenericChain, head_watcher
 from tenacity import retry, stop_after_delay, wait_fixed
 
-getcontext().prec = 15
-
 RUNE = get_rune_asset()
 
 
+class BitcoinRpcError(Exception):
+    """
+    Error returned by the bitcoin node for a RPC call
+    """
+
+    def __init__(self, error):
+        self.code = error.get("code")
+        self.message = error.get("message")
+        super().__init__(f"{self.message} ({self.code})")
+
+
+class UtxoPool:
+    """
+    Local view of the spendable outputs of each address.
+
+    A transfer reserves the output it spends so concurrent transfers never
+    pick the same one, spent outputs are remembered until the node stops
+    listing them and change outputs are added back right away instead of
+    waiting for a block. Unconfirmed chains are kept under the node mempool
+    descendant limit.
+    """
+
+    max_depth = 24
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._available = {}
+        self._reserved = {}
+        self._spent = {}
+
+    def load(self, address, unspents):
+        """
+        Add the node unspents of address not already known, the ones
+        already known are confirmed (listunspent minconf is 1)
+        """
+        with self._lock:
+            listed = {(u["txid"], u["vout"]) for u in unspents}
+            for outpoint, spender in list(self._spent.items()):
+                if spender == address and outpoint not in listed:
+                    del self._spent[outpoint]
+
+            available = self._available.setdefault(address, {})
+            for unspent in unspents:
+                outpoint = (unspent["txid"], unspent["vout"])
+                known = available.get(outpoint) or self._reserved.get(outpoint)
+                if known is not None:
+                    known["depth"] = 0
+                    continue
+                if outpoint in self._spent:
+                    continue
+                available[outpoint] = {
+                    "address": address,
+                    "txid": unspent["txid"],
+                    "vout": unspent["vout"],
+                    "amount": Decimal(unspent["amount"]),
+                    "depth": 0,
+                }
+
+    def add(self, address, txid, vout, amount, depth=0):
+        """
+        Add an output created by a local transaction
+        """
+        with self._lock:
+            self._available.setdefault(address, {})[(txid, vout)] = {
+                "address": address,
+                "txid": txid,
+                "vout": vout,
+                "amount": Decimal(amount),
+                "depth": depth,
+            }
+
+    def count(self, address):
+        return len(self._available.get(address, {}))
+
+    def reserve(self, address, amount):
+        """
+        Reserve the smallest available output of address worth at least amount
+
+        :returns: the output or None if none is big enough
+        """
+        with self._lock:
+            available = self._available.get(address, {})
+            best = None
+            for outpoint, utxo in available.items():
+                if utxo["amount"] < amount or utxo["depth"] >= self.max_depth:
+                    continue
+                if best is None or utxo["amount"] < available[best]["amount"]:
+                    best = outpoint
+            if best is None:
+                return None
+            utxo = self._reserved[best] = available.pop(best)
+            return utxo
+
+    def release(self, utxo):
+        """
+        Give back a reserved output that wasn't spent
+        """
+        with self._lock:
+            outpoint = (utxo["txid"], utxo["vout"])
+            if self._reserved.pop(outpoint, None) is not None:
+                self._available.setdefault(utxo["address"], {})[outpoint] = utxo
+
+    def spend(self, utxo):
+        """
+        Mark a reserved output as spent
+        """
+        with self._lock:
+            outpoint = (utxo["txid"], utxo["vout"])
+            self._reserved.pop(outpoint, None)
+            self._spent[outpoint] = utxo["address"]
+
+
 class MockBitcoin(HttpClient):
     """
     An client implementation for a regtest bitcoin server
@@ -30,15 +151,27 @@ class MockBitcoin(HttpClient):
         "9294f4d108465fd293f7fe299e6923ef71a77f2cb1eb6d4394839c64ec25d5c0",
     ]
     default_gas = 1000000
+    # virtual sizes of a segwit transaction, of a P2WPKH input and output
+    tx_vsize = 11
+    input_vsize = 68
+    output_vsize = 31
+    # smallest P2WPKH output relayed by the node
+    dust_limit = 294
 
     def __init__(self, base_url):
         super().__init__(base_url)
 
         SelectParams("regtest")
+        self.utxos = UtxoPool()
+        self.node_ready = False
 
+        calls = []
         for key in self.private_keys:
             seckey = CBitcoinSecret.from_secret_bytes(codecs.decode(key, "hex_codec"))
-            self.call("importprivkey", str(seckey))
+            calls.append(("importprivkey", str(seckey)))
+        for result in self.call_batch(calls):
+            if isinstance(result, BitcoinRpcError):
+                raise result
 
     @classmethod
     def get_address_from_pubkey(cls, pubkey):
@@ -61,9 +194,39 @@ class MockBitcoin(HttpClient):
         result = self.post("/", payload)
         if result.get("error"):
             logging.error(result["error"])
-            raise (result["error"])
+            raise BitcoinRpcError(result["error"])
         return result["result"]
 
+    def call_batch(self, calls):
+        """
+        Make many independent RPC calls in a single request
+
+        :param list calls: (service, *args) tuples
+        :returns: list of results in the order of the calls,
+            a failed call gives its BitcoinRpcError instead of a result
+        :raises BitcoinRpcError: if the node rejected the whole batch
+        """
+        if not calls:
+            return []
+        payload = [
+            {"version": "1.1", "id": i, "method": service, "params": args}
+            for i, (service, *args) in enumerate(calls)
+        ]
+        result = self.post("/", payload)
+        if not isinstance(result, list):
+            logging.error(result.get("error"))
+            raise BitcoinRpcError(result.get("error") or {})
+        responses = {r["id"]: r for r in result}
+        results = []
+        for i in range(len(calls)):
+            response = responses[i]
+            if response.get("error"):
+                logging.error(response["error"])
+                results.append(BitcoinRpcError(response["error"]))
+            else:
+                results.append(response["result"])
+        return results
+
     def set_vault_address(self, addr):
         """
         Set the vault bnb address
@@ -83,29 +246,49 @@ class MockBitcoin(HttpClient):
         """
         return self.call("getblockhash", int(block_height))
 
+    @property
+    def head(self):
+        """
+        Head of the chain, tracked by the shared head watcher
+        """
+        return head_watcher.watch(self.base_url, self.get_block_height)
+
     def wait_for_blocks(self, count):
         """
         Wait for the given number of blocks
         """
-        start_block = self.get_block_height()
-        for x in range(0, 30):
-            time.sleep(1)
-            block = self.get_block_height()
-            if block - start_block >= count:
-                return
+        return self.head.wait_for_blocks(count)
 
     def invalidate_block(self, block_hash):
         """
         Invalidate a block
         """
         self.call("invalidateblock", block_hash)
+        # outputs of the invalidated blocks are gone
+        self.utxos.clear()
 
     def get_balance(self, address):
         """
         Get BTC balance for an address
         """
-        unspents = self.call("listunspent", 1, 9999999, [address])
-        return int(sum(Decimal(u["amount"]) for u in unspents) * Coin.ONE)
+        return self.get_balances([address])[address]
+
+    def get_balances(self, addresses):
+        """
+        Get BTC balances of many addresses with a single listunspent
+
+        :param list addresses: addresses to get the balance of
+        :returns: dict of balance by address
+        """
+        totals = dict.fromkeys(addresses, Decimal(0))
+        if not totals:
+            return {}
+        unspents = self.call("listunspent", 1, 9999999, list(totals))
+        for unspent in unspents:
+            address = unspent["address"]
+            if address in totals:
+                totals[address] += Decimal(unspent["amount"])
+        return {address: int(total * Coin.ONE) for address, total in totals.items()}
 
     @retry(stop=stop_after_delay(30), wait=wait_fixed(1))
     def wait_for_node(self):
@@ -123,7 +306,9 @@ class MockBitcoin(HttpClient):
         """
         Make a transaction/transfer on regtest bitcoin
         """
-        self.wait_for_node()
+        if not self.node_ready:
+            self.wait_for_node()
+            self.node_ready = True
 
         if not isinstance(txn.coins, list):
             txn.coins = [txn.coins]
@@ -151,32 +336,100 @@ class MockBitcoin(HttpClient):
         tx_out_dest = {txn.to_address: amount}
         tx_out_op_return = {"data": txn.memo.encode().hex()}
 
-        # get unspents UTXOs
+        # reserve an unspent UTXO
         address = txn.from_address
         min_amount = float(amount + (self.default_gas / Coin.ONE))  # add more for fee
-        unspents = self.call(
-            "listunspent", 1, 9999, [str(address)], True, {"minimumAmount": min_amount}
-        )
-        if len(unspents) == 0:
-            raise Exception(f"Cannot transfer. No BTC UTXO available for {address}")
+        unspent = self.reserve_utxo(address, min_amount)
+
+        try:
+            tx_in = [{"txid": unspent["txid"], "vout": unspent["vout"]}]
+            tx_out = [tx_out_dest]
+
+            # create change output if needed
+            amount_utxo = float(unspent["amount"])
+            amount_change = Decimal(amount_utxo) - Decimal(min_amount)
+            amount_change = amount_change.quantize(Decimal("0.00000001"))
+            # change too small to be relayed is left to the fee
+            fee = self.default_gas
+            if amount_change * Coin.ONE < self.dust_limit:
+                fee += int(amount_change * Coin.ONE)
+                amount_change = 0
+            if amount_change > 0:
+                tx_out.append({txn.from_address: float(amount_change)})
+
+            tx_out.append(tx_out_op_return)
+
+            tx = self.call("createrawtransaction", tx_in, tx_out)
+            tx = self.call("signrawtransactionwithwallet", tx)
+            txid = self.call("sendrawtransaction", tx["hex"])
+        except Exception:
+            self.utxos.release(unspent)
+            raise
+
+        # recycle the change for the next transfers
+        self.utxos.spend(unspent)
+        if amount_change > 0:
+            self.utxos.add(address, txid, 1, amount_change, unspent["depth"] + 1)
 
-        # choose the first UTXO
-        unspent = unspents[0]
-        tx_in = [{"txid": unspent["txid"], "vout": unspent["vout"]}]
-        tx_out = [tx_out_dest]
+        txn.id = txid.upper()
+        txn.gas = [Coin("BTC.BTC", fee)]
 
-        # create change output if needed
-        amount_utxo = float(unspent["amount"])
-        amount_change = Decimal(amount_utxo) - Decimal(min_amount)
-        if amount_change > 0:
-            tx_out.append({txn.from_address: float(amount_change)})
+    def reserve_utxo(self, address, amount):
+        """
+        Reserve an UTXO of address worth at least amount BTC,
+        asking the node for its unspents only when none is known locally
+        """
+        unspent = self.utxos.reserve(address, amount)
+        if unspent is None:
+            self.utxos.load(address, self.call("listunspent", 1, 9999, [address]))
+            unspent = self.utxos.reserve(address, amount)
+        if unspent is None:
+            raise Exception(f"Cannot transfer. No BTC UTXO available for {address}")
+        return unspent
 
-        tx_out.append(tx_out_op_return)
+    @classmethod
+    def estimate_fee(cls, inputs, outputs):
+        """
+        Fee of a transaction with the given number of inputs and outputs,
+        at the rate default_gas pays for a 1 input 2 outputs transfer
+        """
+        vsize = cls.tx_vsize + inputs * cls.input_vsize + outputs * cls.output_vsize
+        transfer_vsize = cls.tx_vsize + cls.input_vsize + 2 * cls.output_vsize
+        return -(-cls.default_gas * vsize // transfer_vsize)
 
-        tx = self.call("createrawtransaction", tx_in, tx_out)
-        tx = self.call("signrawtransactionwithwallet", tx)
-        txn.id = self.call("sendrawtransaction", tx["hex"]).upper()
-        txn.gas = [Coin("BTC.BTC", self.default_gas)]
+    def split_utxos(self, address, count, amount):
+        """
+        Fan out the funds of an address into count outputs of amount
+        satoshis, so as many transfers can be sent from it without
+        waiting for a block
+
+        :returns: the fan out transaction id
+        """
+        # without a change output the fee is lower, the unspent covers it too
+        fee = self.estimate_fee(1, count + 1)
+        total = Decimal(count * amount + self.estimate_fee(1, count)) / Coin.ONE
+        unspent = self.reserve_utxo(address, total)
+
+        try:
+            script = CBitcoinAddress(address).to_scriptPubKey()
+            change = int(unspent["amount"] * Coin.ONE) - count * amount - fee
+            tx_out = [CTxOut(amount, script) for _ in range(count)]
+            # change too small to be relayed is left to the fee
+            if change >= self.dust_limit:
+                tx_out.append(CTxOut(change, script))
+            tx_in = [CTxIn(COutPoint(lx(unspent["txid"]), unspent["vout"]))]
+            tx = CMutableTransaction(tx_in, tx_out)
+            tx = self.call("signrawtransactionwithwallet", b2x(tx.serialize()))
+            txid = self.call("sendrawtransaction", tx["hex"])
+        except Exception:
+            self.utxos.release(unspent)
+            raise
+
+        self.utxos.spend(unspent)
+        depth = unspent["depth"] + 1
+        for vout, out in enumerate(tx_out):
+            self.utxos.add(address, txid, vout, Decimal(out.nValue) / Coin.ONE, depth)
+        return txid
 
 
 class Bitcoin(GenericChain):
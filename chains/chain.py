@@ -1,6 +1,228 @@
+import logging
+import threading
+import time
+
 from chains.account import Account
 
 
+class SequenceManager:
+    """
+    Next sequence number (nonce) of each account kept locally, so many
+    transactions of one account can be sent without waiting for the
+    previous ones to be committed
+    """
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self._lock = threading.Lock()
+        self._sequences = {}
+
+    def next(self, address):
+        """
+        Get the next sequence of address, fetching the first one from the node
+        """
+        with self._lock:
+            sequence = self._sequences.get(address)
+            if sequence is None:
+                sequence = self.fetch(address)
+            self._sequences[address] = sequence + 1
+            return sequence
+
+    def reset(self, address=None):
+        """
+        Forget the sequence of address (or every address),
+        the next one is fetched again from the node
+        """
+        with self._lock:
+            if address is None:
+                self._sequences = {}
+            else:
+                self._sequences.pop(address, None)
+
+
+class ChainHead:
+    """
+    Tip of one chain tracked by a background poller.
+
+    The poller sleeps at max_interval while nobody waits on the chain. With
+    waiters it sleeps until the next block is due according to the observed
+    block time, then polls every quarter block time until the block shows up.
+    """
+
+    def __init__(self, name, get_height, min_interval=0.1, max_interval=2):
+        self.name = name
+        self.get_height = get_height
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.height = None
+        self.block_time = None
+        self.polls = 0
+        self.errors = 0
+        self._last_change = None
+        self._waiters = 0
+        self._changed = threading.Condition()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._changed:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"head-{self.name}", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.poll()
+            self._wake.wait(self.next_interval())
+            self._wake.clear()
+
+    def poll(self):
+        """
+        Fetch the chain height once and wake up the waiters
+        """
+        try:
+            height = self.get_height()
+        except Exception as e:
+            logging.debug(f"{self.name} height: {e}")
+            height = None
+        now = time.monotonic()
+        with self._changed:
+            if height is None:
+                self.errors += 1
+            elif height != self.height:
+                if self.height is not None and height > self.height:
+                    sample = (now - self._last_change) / (height - self.height)
+                    if self.block_time is None:
+                        self.block_time = sample
+                    else:
+                        self.block_time = 0.8 * self.block_time + 0.2 * sample
+                self.height = height
+                self._last_change = now
+            self.polls += 1
+            self._changed.notify_all()
+
+    def next_interval(self):
+        """
+        Seconds to sleep before the next poll
+        """
+        with self._changed:
+            if self._waiters == 0:
+                return self.max_interval
+            if self.block_time is None or self._last_change is None:
+                return self.min_interval
+            due = self._last_change + self.block_time - time.monotonic()
+            if due <= 0:
+                due = self.block_time / 4
+        return min(max(due, self.min_interval), self.max_interval)
+
+    def wait(self, predicate, timeout=30):
+        """
+        Block until predicate(height) is true or timeout
+
+        :returns: True if the predicate was satisfied
+        """
+        self.start()
+        with self._changed:
+            self._waiters += 1
+            self._wake.set()
+            try:
+                return self._changed.wait_for(
+                    lambda: self.height is not None and predicate(self.height),
+                    timeout,
+                )
+            finally:
+                self._waiters -= 1
+
+    def refresh(self, timeout=30):
+        """
+        Poll now and return the fresh height, concurrent callers share the poll
+        """
+        self.start()
+        with self._changed:
+            polls = self.polls
+            self._waiters += 1
+            self._wake.set()
+            try:
+                self._changed.wait_for(lambda: self.polls > polls, timeout)
+            finally:
+                self._waiters -= 1
+            return self.height
+
+    def wait_for_height(self, height, timeout=30):
+        """
+        Block until the chain reaches height
+        """
+        return self.wait(lambda current: current >= height, timeout)
+
+    def wait_for_blocks(self, count, timeout=30):
+        """
+        Block until count new blocks from the current height
+        """
+        deadline = time.monotonic() + timeout
+        start = self.refresh(timeout)
+        if start is None:
+            return False
+        remaining = max(deadline - time.monotonic(), 0)
+        return self.wait(lambda current: current - start >= count, remaining)
+
+
+class HeadWatcher:
+    """
+    Shared registry of the chain heads, one poller per chain whatever the
+    number of clients waiting on it
+    """
+
+    def __init__(self, min_interval=0.1, max_interval=2):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._lock = threading.Lock()
+        self._heads = {}
+
+    def watch(self, name, get_height):
+        """
+        Get the head of a chain, registering it on first use
+
+        :param str name: chain key, e.g. the url of its node
+        :param func get_height: returns the current height of the chain
+        """
+        with self._lock:
+            head = self._heads.get(name)
+            if head is None:
+                head = self._heads[name] = ChainHead(
+                    name, get_height, self.min_interval, self.max_interval
+                )
+            return head
+
+    def get_stats(self):
+        with self._lock:
+            heads = list(self._heads.values())
+        return {
+            head.name: {
+                "height": head.height,
+                "block_time": head.block_time,
+                "polls": head.polls,
+                "errors": head.errors,
+            }
+            for head in heads
+        }
+
+    def stop(self):
+        with self._lock:
+            for head in self._heads.values():
+                head.stop()
+            self._heads = {}
+
+
+head_watcher = HeadWatcher()
+
+
 class GenericChain:
     """
     A local simple implementation of a generic chain
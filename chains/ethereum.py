@@ -6,9 +6,15 @@ import requests
 from web3 import Web3, HTTPProvider
 from web3.middleware import geth_poa_middleware
 from eth_keys import KeyAPI
-from utils.common import Coin, get_rune_asset, Asset
+from utils.common import (
+    Coin,
+    get_rune_asset,
+    Asset,
+    get_policy,
+    requests_retry_session,
+)
 from chains.aliases import aliases_eth, get_aliases, get_alias_address
-from chains.chain import GenericChain
+from chains.chain import GenericChain, SequenceManager, head_watcher
 
 RUNE = get_rune_asset()
 
@@ -35,19 +41,25 @@ class MockEthereum:
         "9294f4d108465fd293f7fe299e6923ef71a77f2cb1eb6d4394839c64ec25d5c0",
     ]
 
-    def __init__(self, base_url):
+    def __init__(self, base_url, policy=None):
         self.url = base_url
+        # json rpc calls made outside of web3 are bounded by the retry policy
+        self.policy = policy or get_policy(base_url)
+        self.session = requests_retry_session(policy=self.policy)
         for key in self.private_keys:
             payload = json.dumps(
                 {"method": "personal_importRawKey", "params": [key, self.passphrase]}
             )
             headers = {"content-type": "application/json", "cache-control": "no-cache"}
             try:
-                requests.request("POST", base_url, data=payload, headers=headers)
+                self.session.post(base_url, data=payload, headers=headers)
             except requests.exceptions.RequestException as e:
                 logging.error(f"{e}")
         self.web3 = Web3(HTTPProvider(base_url))
         self.web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+        self.nonces = SequenceManager(
+            lambda address: self.web3.eth.getTransactionCount(address, "pending")
+        )
 
     @classmethod
     def get_address_from_pubkey(cls, pubkey):
@@ -88,20 +100,45 @@ class MockEthereum:
         payload = json.dumps({"method": "debug_setHead", "params": [block_height]})
         headers = {"content-type": "application/json", "cache-control": "no-cache"}
         try:
-            requests.request("POST", self.url, data=payload, headers=headers)
+            self.session.post(self.url, data=payload, headers=headers)
         except requests.exceptions.RequestException as e:
             logging.error(f"{e}")
+        # transactions after the new head are gone
+        self.nonces.reset()
+
+    def call_batch(self, calls):
+        """
+        Make many JSON-RPC calls in a single request
+
+        :param list calls: (method, params) tuples
+        :returns: list of results in the order of the calls
+        """
+        payload = [
+            {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+            for i, (method, params) in enumerate(calls)
+        ]
+        resp = self.session.post(self.url, json=payload)
+        resp.raise_for_status()
+        responses = {r["id"]: r for r in resp.json()}
+        results = []
+        for i in range(len(calls)):
+            if responses[i].get("error"):
+                raise Exception(f"{calls[i][0]} failed: {responses[i]['error']}")
+            results.append(responses[i].get("result"))
+        return results
+
+    @property
+    def head(self):
+        """
+        Head of the chain, tracked by the shared head watcher
+        """
+        return head_watcher.watch(self.url, self.get_block_height)
 
     def wait_for_blocks(self, count):
         """
         Wait for the given number of blocks
         """
-        start_block = self.get_block_height()
-        for x in range(0, 30):
-            time.sleep(1)
-            block = self.get_block_height()
-            if block - start_block >= count:
-                return
+        return self.head.wait_for_blocks(count)
 
     def get_balance(self, address):
         """
@@ -109,19 +146,26 @@ class MockEthereum:
         """
         return self.web3.eth.getBalance(Web3.toChecksumAddress(address), "latest")
 
+    def get_balances(self, addresses):
+        """
+        Get ETH balances of many addresses
+
+        :returns: dict of balance by address
+        """
+        return {address: self.get_balance(address) for address in addresses}
+
     def wait_for_node(self):
         """
         Ethereum localnet node is started with directly mining 100 blocks
         to be able to start handling transactions.
         It can take a while depending on the machine specs so we retry.
         """
-        current_height = self.get_block_height()
-        while current_height < 4:
-            current_height = self.get_block_height()
+        if not self.head.wait_for_height(4, timeout=120):
+            raise Exception("Ethereum localnet not ready")
 
-    def transfer(self, txn):
+    def prepare(self, txn):
         """
-        Make a transaction/transfer on localnet Ethereum
+        Resolve the aliases of a transaction and build its Ethereum transaction
         """
         if not isinstance(txn.coins, list):
             txn.coins = [txn.coins]
@@ -152,11 +196,74 @@ class MockEthereum:
             "data": "0x" + txn.memo.encode().hex(),
             "gas": calculate_gas(txn.memo),
         }
+        return tx
 
-        tx_hash = self.web3.geth.personal.send_transaction(tx, self.passphrase)
+    def send(self, tx):
+        """
+        Send an Ethereum transaction with the next local nonce of its sender
+        """
+        tx["nonce"] = self.nonces.next(tx["from"])
+        try:
+            return self.web3.geth.personal.send_transaction(tx, self.passphrase)
+        except Exception:
+            self.nonces.reset(tx["from"])
+            raise
+
+    def transfer(self, txn):
+        """
+        Make a transaction/transfer on localnet Ethereum
+        """
+        tx_hash = self.send(self.prepare(txn))
         receipt = self.web3.eth.waitForTransactionReceipt(tx_hash)
         txn.id = receipt["transactionHash"].hex()[2:].upper()
-        txn.gas = [Coin("ETH.ETH", receipt["cumulativeGasUsed"] * self.gas_price)]
+        txn.gas = [Coin("ETH.ETH", receipt["gasUsed"] * self.gas_price)]
+
+    def transfer_pipelined(self, txns, timeout=120):
+        """
+        Submit many transactions without waiting for each one to be mined,
+        then collect their receipts in one batch request per new block.
+        Fills in the id and gas of every transaction.
+
+        :returns: dict of inclusion latency (seconds, blocks) by transaction id
+        """
+        start_height = self.get_block_height()
+        pending = {}
+        for txn in txns:
+            tx_hash = self.send(self.prepare(txn)).hex()
+            pending[tx_hash] = (txn, time.time())
+
+        latencies = {}
+        height = start_height
+        deadline = time.time() + timeout
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not self.head.wait_for_height(height + 1, remaining):
+                raise Exception(f"{len(pending)} ETH transactions not mined")
+            height = self.head.height
+
+            hashes = list(pending)
+            calls = [("eth_getTransactionReceipt", [h]) for h in hashes]
+            now = time.time()
+            for tx_hash, receipt in zip(hashes, self.call_batch(calls)):
+                if receipt is None:
+                    continue
+                txn, sent = pending.pop(tx_hash)
+                txn.id = tx_hash[2:].upper()
+                # a block can hold many of our transactions, so use their
+                # own gas instead of the cumulative gas of the block
+                gas = int(receipt["gasUsed"], 16) * self.gas_price
+                txn.gas = [Coin("ETH.ETH", gas)]
+                blocks = int(receipt["blockNumber"], 16) - start_height
+                latencies[txn.id] = (now - sent, blocks)
+
+        if latencies:
+            seconds = [latency for latency, _ in latencies.values()]
+            logging.info(
+                f"ETH inclusion latency: {len(seconds)} txs | "
+                f"avg {sum(seconds) / len(seconds):.2f}s | max {max(seconds):.2f}s | "
+                f"max {max(b for _, b in latencies.values())} blocks"
+            )
+        return latencies
 
 
 class Ethereum(GenericChain):
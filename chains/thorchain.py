@@ -3,14 +3,15 @@ import hashlib
 import os
 import json
 import logging
-import requests
+import threading
+import time
 
 import ecdsa
 
 from utils.segwit_addr import address_from_public_key
 from utils.common import HttpClient, Coin, Asset
 from chains.aliases import get_alias_address, get_aliases, get_alias
-from chains.chain import GenericChain
+from chains.chain import GenericChain, SequenceManager
 from chains.account import Account
 
 # Init logging
@@ -20,26 +21,149 @@ logging.basicConfig(
 )
 
 
+try:
+    import coincurve
+    from coincurve.ecdsa import cdata_to_der, deserialize_compact
+except ImportError:  # optional, the pure python ecdsa backend is used instead
+    coincurve = None
+
+
+class EcdsaBackend:
+    """
+    secp256k1 curve math with the pure python ecdsa package
+    """
+
+    name = "ecdsa"
+
+    def generate(self):
+        return ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1).to_string()
+
+    def load(self, privkey):
+        return ecdsa.SigningKey.from_string(privkey, curve=ecdsa.SECP256k1)
+
+    def load_public(self, pubkey):
+        key = ecdsa.VerifyingKey.from_string(pubkey, curve=ecdsa.SECP256k1)
+        # tables of the point, worth it as the key is kept in a key ring
+        key.precompute()
+        return key
+
+    def public_key(self, key):
+        return key.get_verifying_key().to_string("compressed")
+
+    def sign(self, key, message):
+        return key.sign_deterministic(
+            message,
+            hashfunc=hashlib.sha256,
+            sigencode=ecdsa.util.sigencode_string_canonize,
+        )
+
+    def verify(self, public_key, message, signature):
+        try:
+            return public_key.verify(signature, message, hashfunc=hashlib.sha256)
+        except ecdsa.BadSignatureError:
+            return False
+
+
+class Secp256k1Backend:
+    """
+    secp256k1 curve math with libsecp256k1 through coincurve,
+    signatures are the same deterministic low-s ones as EcdsaBackend
+    """
+
+    name = "secp256k1"
+
+    def generate(self):
+        return coincurve.PrivateKey().secret
+
+    def load(self, privkey):
+        return coincurve.PrivateKey(privkey)
+
+    def load_public(self, pubkey):
+        return coincurve.PublicKey(pubkey)
+
+    def public_key(self, key):
+        return key.public_key.format(compressed=True)
+
+    def sign(self, key, message):
+        # drop the recovery id to get the 64 bytes r || s signature
+        return key.sign_recoverable(message)[:64]
+
+    def verify(self, public_key, message, signature):
+        der = cdata_to_der(deserialize_compact(signature))
+        return public_key.verify(der, message)
+
+
+BACKENDS = {"ecdsa": EcdsaBackend()}
+if coincurve is not None:
+    BACKENDS["secp256k1"] = Secp256k1Backend()
+
+
+def get_backend(name=None):
+    """
+    Get a secp256k1 backend by name, the fastest one installed by default
+    """
+    if name is None:
+        name = "secp256k1" if "secp256k1" in BACKENDS else "ecdsa"
+    return BACKENDS[name]
+
+
+class KeyRing:
+    """
+    Signing keys parsed once per name,
+    with their compressed public key and verifying key
+    """
+
+    def __init__(self, private_keys, backend=None):
+        self.private_keys = private_keys
+        self.backend = backend or get_backend()
+        self._lock = threading.Lock()
+        self._keys = {}
+
+    def get(self, name):
+        """
+        Get the (signing key, public key bytes, verifying key) of name
+        """
+        keys = self._keys.get(name)
+        if keys is None:
+            with self._lock:
+                keys = self._keys.get(name)
+                if keys is None:
+                    key = self.backend.load(bytes.fromhex(self.private_keys[name]))
+                    pubkey = self.backend.public_key(key)
+                    keys = (key, pubkey, self.backend.load_public(pubkey))
+                    self._keys[name] = keys
+        return keys
+
+    def public_key(self, name):
+        """
+        Get the compressed public key of name, hex encoded
+        """
+        return self.get(name)[1].hex()
+
+    def sign(self, name, message):
+        return self.backend.sign(self.get(name)[0], message)
+
+    def verify(self, name, message, signature):
+        return self.backend.verify(self.get(name)[2], message, signature)
+
+
 # wallet helper functions
 # Thanks to https://github.com/hukkinj1/cosmospy
 def generate_wallet():
-    privkey = ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1).to_string().hex()
+    privkey = get_backend().generate().hex()
     pubkey = privkey_to_pubkey(privkey)
-    address = address_from_public_key(pubkey)
+    address = address_from_public_key(bytes.fromhex(pubkey), "tthor")
     return {"private_key": privkey, "public_key": pubkey, "address": address}
 
 
 def privkey_to_pubkey(privkey):
-    privkey_obj = ecdsa.SigningKey.from_string(
-        bytes.fromhex(privkey), curve=ecdsa.SECP256k1
-    )
-    pubkey_obj = privkey_obj.get_verifying_key()
-    return pubkey_obj.to_string("compressed").hex()
+    backend = get_backend()
+    return backend.public_key(backend.load(bytes.fromhex(privkey))).hex()
 
 
 def privkey_to_address(privkey):
     pubkey = privkey_to_pubkey(privkey)
-    return address_from_public_key(pubkey)
+    return address_from_public_key(bytes.fromhex(pubkey), "tthor")
 
 
 class MockThorchain(HttpClient):
@@ -54,6 +178,12 @@ class MockThorchain(HttpClient):
         "STAKER-2": "e810f1d7d6691b4a7a73476f3543bd87d601f9a53e7faf670eac2c5b517d83bf",
     }
 
+    def __init__(self, base_url):
+        super().__init__(base_url)
+        self.sequences = SequenceManager(self._get_sequence)
+        self.account_numbers = {}
+        self.keys = KeyRing(self.private_keys)
+
     def get_balance(self, address, asset=Asset("THOR.RUNE")):
         """
         Get THOR balance for an address
@@ -70,57 +200,175 @@ class MockThorchain(HttpClient):
                     return int(coin["amount"])
         return 0
 
+    def get_balances(self, addresses, asset=Asset("THOR.RUNE")):
+        """
+        Get THOR balances of many addresses
+
+        :returns: dict of balance by address
+        """
+        return {address: self.get_balance(address, asset) for address in addresses}
+
+    def prepare(self, txn):
+        """
+        Resolve the aliases of a transaction
+
+        :returns: name of the key signing it
+        """
+        if not isinstance(txn.coins, list):
+            txn.coins = [txn.coins]
+
+        # signing key name, the address may already be resolved
+        name = get_alias(txn.chain, txn.from_address)
+        txn.gas = [Coin("THOR.RUNE", 100000000)]
+        if txn.from_address in get_aliases():
+            txn.from_address = get_alias_address(txn.chain, txn.from_address)
+        if txn.to_address in get_aliases():
+            txn.to_address = get_alias_address(txn.chain, txn.to_address)
+
+        # update memo with actual address (over alias name)
+        for alias in get_aliases():
+            chain = txn.chain
+            asset = txn.get_asset_from_memo()
+            if asset:
+                chain = asset.get_chain()
+            addr = get_alias_address(chain, alias)
+            txn.memo = txn.memo.replace(alias, addr)
+        return name
+
+    def build(self, txn):
+        """
+        Build the messages and fee of a native transaction
+
+        :returns: (msgs, fee)
+        """
+        payload = {
+            "coins": [coin.to_thorchain_fmt() for coin in txn.coins],
+            "memo": txn.memo,
+            "base_req": {"chain_id": "thorchain", "from": txn.from_address},
+        }
+        payload = self.post("/thorchain/native/tx", payload)
+        return payload["value"]["msg"], payload["value"]["fee"]
+
+    def sign(self, name, address, msgs, fee):
+        """
+        Sign messages with the next sequence of the account
+
+        :returns: pushable transaction
+        """
+        seq = self.sequences.next(address)
+        acct_num = self.account_numbers[address]
+        sig = self._sign(
+            name, self._get_sign_message("thorchain", acct_num, fee, seq, msgs)
+        )
+        return self.get_pushable(name, msgs, sig, fee, acct_num, seq)
+
+    def broadcast(self, address, pushable):
+        """
+        Send a signed transaction, the sequences of its account are
+        fetched again from the node when it is rejected
+        """
+        try:
+            result = self.send(pushable)
+        except Exception:
+            self.sequences.reset(address)
+            raise
+        if result.get("code"):
+            logging.warning(f"THOR tx rejected: {result.get('raw_log')}")
+            self.sequences.reset(address)
+        return result
+
     def transfer(self, txns):
         if not isinstance(txns, list):
             txns = [txns]
 
         for txn in txns:
-            if not isinstance(txn.coins, list):
-                txn.coins = [txn.coins]
-
-            name = txn.from_address
-            txn.gas = [Coin("THOR.RUNE", 100000000)]
-            if txn.from_address in get_aliases():
-                txn.from_address = get_alias_address(txn.chain, txn.from_address)
-            if txn.to_address in get_aliases():
-                txn.to_address = get_alias_address(txn.chain, txn.to_address)
-
-            # update memo with actual address (over alias name)
-            for alias in get_aliases():
-                chain = txn.chain
-                asset = txn.get_asset_from_memo()
-                if asset:
-                    chain = asset.get_chain()
-                addr = get_alias_address(chain, alias)
-                txn.memo = txn.memo.replace(alias, addr)
-
-            acct = self._get_account(txn.from_address)
-
-            payload = {
-                "coins": [coin.to_thorchain_fmt() for coin in txn.coins],
-                "memo": txn.memo,
-                "base_req": {"chain_id": "thorchain", "from": txn.from_address},
-            }
-
-            payload = self.post("/thorchain/native/tx", payload)
-            msgs = payload["value"]["msg"]
-            fee = payload["value"]["fee"]
-            acct_num = acct["result"]["value"]["account_number"]
-            seq = acct["result"]["value"]["sequence"]
-            sig = self._sign(
-                name, self._get_sign_message("thorchain", acct_num, fee, seq, msgs)
-            )
-            pushable = self.get_pushable(name, msgs, sig, fee, acct_num, seq)
-            result = self.send(pushable)
+            name = self.prepare(txn)
+            msgs, fee = self.build(txn)
+            pushable = self.sign(name, txn.from_address, msgs, fee)
+            result = self.broadcast(txn.from_address, pushable)
             txn.id = result["txhash"]
 
+    def presign(self, txns):
+        """
+        Build and sign many transactions ahead of broadcasting them,
+        identical transactions are built by the node only once
+
+        :returns: list of (txn, pushable)
+        """
+        built = {}
+        signed = []
+        for txn in txns:
+            name = self.prepare(txn)
+            key = json.dumps(
+                [txn.from_address, txn.memo, [c.to_thorchain_fmt() for c in txn.coins]]
+            )
+            if key not in built:
+                built[key] = self.build(txn)
+            msgs, fee = built[key]
+            signed.append((txn, self.sign(name, txn.from_address, msgs, fee)))
+        return signed
+
+    def broadcast_presigned(self, signed):
+        """
+        Broadcast pre-signed transactions without waiting for blocks.
+        Each account sends its transactions in sequence order from its own
+        thread, accounts are sent in parallel. After a rejection the next
+        transactions of the account are skipped as their sequence is wrong.
+
+        :returns: dict of sent, rejected and skipped counts and seconds
+        """
+        by_account = {}
+        for txn, pushable in signed:
+            by_account.setdefault(txn.from_address, []).append((txn, pushable))
+
+        stats = {"sent": 0, "rejected": 0, "skipped": 0}
+        lock = threading.Lock()
+
+        def send_all(address, pending):
+            for i, (txn, pushable) in enumerate(pending):
+                try:
+                    result = self.broadcast(address, pushable)
+                except Exception as e:
+                    logging.error(f"THOR broadcast failed: {e}")
+                    result = {"code": -1}
+                if result.get("code"):
+                    with lock:
+                        stats["rejected"] += 1
+                        stats["skipped"] += len(pending) - i - 1
+                    return
+                txn.id = result["txhash"]
+                with lock:
+                    stats["sent"] += 1
+
+        start = time.time()
+        threads = [
+            threading.Thread(target=send_all, args=item, daemon=True)
+            for item in by_account.items()
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats["seconds"] = time.time() - start
+        logging.info(
+            f"THOR broadcast: {stats['sent']} txs | {stats['rejected']} rejected | "
+            f"{stats['skipped']} skipped | {stats['seconds']:.2f}s"
+        )
+        return stats
+
+    def transfer_pipelined(self, txns):
+        """
+        Pre-sign all the transactions then broadcast them pipelined
+        """
+        return self.broadcast_presigned(self.presign(txns))
+
     def send(self, payload):
-        resp = requests.post(self.get_url("/txs"), data=payload)
+        resp = self.session.post(self.get_url("/txs"), data=payload)
         resp.raise_for_status()
         return resp.json()
 
     def get_pushable(self, name, msgs, sig, fee, acct_num, seq) -> str:
-        pubkey = privkey_to_pubkey(self.private_keys[name])
+        pubkey = self.keys.public_key(name)
         base64_pubkey = base64.b64encode(bytes.fromhex(pubkey)).decode("utf-8")
         pushable_tx = {
             "tx": {
@@ -147,14 +395,7 @@ class MockThorchain(HttpClient):
         message_str = json.dumps(body, separators=(",", ":"), sort_keys=True)
         message_bytes = message_str.encode("utf-8")
 
-        privkey = ecdsa.SigningKey.from_string(
-            bytes.fromhex(self.private_keys[name]), curve=ecdsa.SECP256k1
-        )
-        signature_compact = privkey.sign_deterministic(
-            message_bytes,
-            hashfunc=hashlib.sha256,
-            sigencode=ecdsa.util.sigencode_string_canonize,
-        )
+        signature_compact = self.keys.sign(name, message_bytes)
 
         signature_base64_str = base64.b64encode(signature_compact).decode("utf-8")
         return signature_base64_str
@@ -172,6 +413,11 @@ class MockThorchain(HttpClient):
     def _get_account(self, address):
         return self.fetch("/auth/accounts/" + address)
 
+    def _get_sequence(self, address):
+        value = self._get_account(address)["result"]["value"]
+        self.account_numbers[address] = int(value["account_number"])
+        return int(value["sequence"])
+
 
 class Thorchain(GenericChain):
     """
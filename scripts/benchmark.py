@@ -150,7 +150,7 @@ class Benchie:
 
         logging.info("<<< done.")
         logging.info(">>> broadcasting transactions...")
-        self.mock_binance.transfer(txns)
+        self.mock_binance.transfer_bulk(txns)
         logging.info("<<< done.")
 
         logging.info(">>> timing for thorchain...")
@@ -158,15 +158,13 @@ class Benchie:
         t1 = time.time()
         completed = 0
 
+        event_type = self.tx_type.lower()
         pbar = tqdm(total=self.num)
         while completed < self.num:
-            events = self.thorchain_client.events
-            if len(events) == 0:
-                time.sleep(1)
-                continue
-            completed = len([e for e in events if e.type == self.tx_type.lower()])
-            pbar.update(completed)
-            time.sleep(1)
+            self.thorchain_client.wait_for_events(completed + 1, event_type, timeout=1)
+            count = self.thorchain_client.events.count(event_type)
+            pbar.update(count - completed)
+            completed = count
         pbar.close()
 
         t2 = time.time()
@@ -78,10 +78,11 @@ class Health:
     def retrieve_data(self):
         """Retrieve data from APIs needed to run health checks.
         """
-        self.thorchain_asgard_vaults = self.thorchain_client.get_asgard_vaults()
-        for vault in self.thorchain_asgard_vaults:
+        self.thorchain_asgard_vaults = []
+        for vault in self.thorchain_client.get_asgard_vaults():
             if vault["coins"]:
-                vault["coins"] = [Coin.from_dict(c) for c in vault["coins"]]
+                vault = {**vault, "coins": [Coin.from_dict(c) for c in vault["coins"]]}
+            self.thorchain_asgard_vaults.append(vault)
 
         self.binance_accounts = []
         accounts = self.binance_client.accounts()
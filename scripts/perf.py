@@ -0,0 +1,320 @@
+import argparse
+import base64
+import ecdsa
+import hashlib
+import json
+import logging
+import os
+import sys
+import timeit
+import tracemalloc
+
+from decimal import Decimal, getcontext
+from functools import partial
+
+from thorchain.thorchain import (
+    ThorchainClient,
+    ThorchainState,
+    Pool,
+    Staker,
+    Event,
+    EventBuffer,
+    FramePipeline,
+    RUNE,
+)
+from chains.thorchain import MockThorchain, KeyRing, BACKENDS
+from utils.common import Transaction, Coin
+from utils.amm import get_share, calc_asset_emission, calc_stake_units
+
+# Init logging
+logging.basicConfig(
+    format="%(asctime)s | %(levelname).4s | %(message)s",
+    level=os.environ.get("LOGLEVEL", "INFO"),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--bench",
+        default="all",
+        help=f"Micro benchmark to run ({', '.join(BENCHES)} or all)",
+    )
+    parser.add_argument(
+        "--num", type=int, default=10000, help="Number of iterations per measure"
+    )
+    args = parser.parse_args()
+
+    benches = BENCHES.keys() if args.bench == "all" else [args.bench]
+    for name in benches:
+        if name not in BENCHES:
+            logging.error(f"unknown benchmark: {name}")
+            sys.exit(1)
+        logging.info(f">>> {name}")
+        BENCHES[name](args.num)
+        logging.info("<<< done.")
+
+
+def measure(func, num):
+    """
+    Run func num times and return the best time per call in nanoseconds
+    """
+    best = min(timeit.repeat(func, number=num, repeat=5))
+    return best / num * 1e9
+
+
+def bench_pools(num):
+    """
+    Lookup and update cost of the thorchain state pools
+    """
+    for count in [10, 100, 1000, 10000]:
+        state = ThorchainState()
+        for i in range(count):
+            state.set_pool(Pool(f"BNB.TKN{i}", 100000000, 100000000))
+        last = state.get_pool(f"BNB.TKN{count - 1}")
+        get_ns = measure(lambda: state.get_pool(last.asset), num)
+        set_ns = measure(lambda: state.set_pool(last), num)
+        logging.info(
+            f"pools: {count:>6} | get_pool {get_ns:8.0f} ns | "
+            f"set_pool {set_ns:8.0f} ns"
+        )
+
+
+def bench_stakers(num):
+    """
+    Lookup and stake cost of the pool stakers
+    """
+    for count in [10, 1000, 100000]:
+        pool = Pool("BNB.BNB", 100000000, 100000000)
+        for i in range(count):
+            pool.set_staker(Staker(f"tbnb{i}", 100))
+        address = f"tbnb{count - 1}"
+        get_ns = measure(lambda: pool.get_staker(address), num)
+        stake_ns = measure(lambda: pool.stake(address, 1, 1, pool.asset, "TX"), num)
+        logging.info(
+            f"stakers: {count:>6} | get_staker {get_ns:8.0f} ns | "
+            f"stake {stake_ns:8.0f} ns"
+        )
+
+
+def bench_swap(num):
+    """
+    Cost of handling a double swap against pools with many stakers
+    """
+    for count in [10, 1000, 100000]:
+        state = ThorchainState()
+        for asset in ["BNB.BNB", "BNB.LOK-3C0"]:
+            pool = Pool(asset, 1000000 * Coin.ONE, 1000000 * Coin.ONE)
+            for i in range(count):
+                pool.set_staker(Staker(f"tbnb{i}", 100))
+            state.set_pool(pool)
+        txn = Transaction(
+            "BNB", "USER-1", "VAULT", [Coin("BNB.BNB", Coin.ONE)], "SWAP:BNB.LOK-3C0"
+        )
+        swap_ns = measure(lambda: state.handle(txn), num)
+        logging.info(f"stakers: {count:>6} | double swap {swap_ns:8.0f} ns")
+
+
+def decimal_share(part, total, alloc):
+    """
+    Previous Decimal based get_share, kept as a reference
+    """
+    if total == 0 or part == 0:
+        return 0
+    getcontext().prec = 18
+    return int(round(Decimal(alloc) / (Decimal(total) / Decimal(part))))
+
+
+def float_stake_units(P, R, A, r, a):
+    """
+    Previous float based stake units, kept as a reference
+    """
+    R, A, r, a = float(R), float(A), float(r), float(a)
+    if R == 0.0 or A == 0.0:
+        return int(r)
+    slipAdjustment = 1 - abs((R * a - r * A) / ((2 * r + R) * (a + A)))
+    units = (P * (a * R + A * r)) / (2 * A * R)
+    return int(units * slipAdjustment)
+
+
+def bench_math(num):
+    """
+    Cost of the integer pool math against the previous Decimal/float versions
+    """
+    share = (149506590, 50165561086, 50000000)
+    emission = (94382619747, 100001000, 301902607)
+    stake = (44611997190, 112928660551, 257196272, 50000000000, 40000000000)
+    cases = [
+        ("get_share", decimal_share, get_share, share),
+        (
+            "emission",
+            lambda X, x, Y: int((x * X * Y) / (x + X) ** 2),
+            calc_asset_emission,
+            emission,
+        ),
+        ("stake_units", float_stake_units, calc_stake_units, stake),
+    ]
+    for name, old, new, args in cases:
+        old_ns = measure(partial(old, *args), num)
+        new_ns = measure(partial(new, *args), num)
+        logging.info(
+            f"{name:>12} | previous {old_ns:6.0f} ns | integer {new_ns:6.0f} ns | "
+            f"x{old_ns / new_ns:.1f}"
+        )
+
+
+def bench_quote(num):
+    """
+    Cost of quoting many swap sizes, scalar swap against quote_swaps
+    """
+    state = ThorchainState()
+    state.set_pool(Pool("BNB.BNB", 1000000 * Coin.ONE, 1000000 * Coin.ONE))
+    state.set_pool(Pool("BNB.LOK-3C0", 1000000 * Coin.ONE, 1000000 * Coin.ONE))
+    amounts = list(range(Coin.ONE, Coin.ONE * (num + 1), Coin.ONE))
+    for target in [RUNE, "BNB.LOK-3C0"]:
+
+        def scalar():
+            for amount in amounts:
+                emit = state.swap(Coin("BNB.BNB", amount), RUNE)[0]
+                if target != RUNE:
+                    state.swap(emit, target)
+
+        scalar_ns = measure(scalar, 1) / num
+        batch_ns = measure(lambda: state.quote_swaps(amounts, "BNB.BNB", target), 1)
+        logging.info(
+            f"BNB.BNB => {target:<12} | swap {scalar_ns:6.0f} ns | "
+            f"quote_swaps {batch_ns / num:6.0f} ns | x{scalar_ns * num / batch_ns:.1f}"
+        )
+
+
+def bench_events(num):
+    """
+    Memory and attribute access cost of events
+    """
+    txn = Transaction(
+        "BNB", "USER-1", "VAULT", [Coin("BNB.BNB", Coin.ONE)], "SWAP:BNB.LOK-3C0"
+    )
+
+    def attributes(i):
+        return [
+            {"pool": "BNB.BNB"},
+            {"price_target": 0},
+            {"trade_slip": i},
+            {"liquidity_fee": i},
+            {"liquidity_fee_in_rune": i},
+            *txn.get_attributes(),
+        ]
+
+    tracemalloc.start()
+    start = tracemalloc.take_snapshot()
+    events = [Event("swap", attributes(i)) for i in range(num)]
+    size = tracemalloc.take_snapshot().compare_to(start, "filename")
+    tracemalloc.stop()
+    event_bytes = sum(stat.size_diff for stat in size) / num
+    get_ns = measure(lambda: events[-1].get("memo"), num)
+    logging.info(f"events: {num} | {event_bytes:.0f} bytes/event | get {get_ns:.0f} ns")
+    sort_s = min(timeit.repeat(lambda: sorted(events), number=1, repeat=3))
+    logging.info(f"events: {num} | sorted {sort_s:.3f} s")
+
+
+def bench_buffer(num):
+    """
+    Cost of adding events to the client event buffer and reading the latest
+    """
+    for count in [1000, 100000]:
+        buffer = EventBuffer()
+        events = [Event("swap", [{"id": i}]) for i in range(10)]
+        for height in range(count // 10):
+            buffer.add(events, height, "tx")
+        height = count // 10
+        add_ns = measure(lambda: buffer.add(events, height, "block"), num)
+        read_ns = measure(lambda: buffer[len(buffer) - 10 :], num)
+        logging.info(
+            f"events: {count:>6} | add 10 {add_ns:6.0f} ns | "
+            f"read last 10 {read_ns:6.0f} ns"
+        )
+
+
+def bench_frames(num):
+    """
+    Websocket thread cost of a frame, inline decoding against the pipeline
+    """
+
+    def encode(text):
+        return base64.b64encode(str(text).encode()).decode()
+
+    events = [
+        {
+            "type": "swap",
+            "attributes": [
+                {"key": encode(key), "value": encode(i)}
+                for key in ["pool", "trade_slip", "liquidity_fee", "id", "memo"]
+            ],
+        }
+        for i in range(10)
+    ]
+    value = {"TxResult": {"height": "1", "result": {"events": events}}}
+    frame = json.dumps({"result": {"data": {"type": "Tx", "value": value}}})
+    client = ThorchainClient.__new__(ThorchainClient)
+    client.events = EventBuffer()
+    decode_ns = measure(lambda: client.commit_frame(client.decode_frame(frame)), num)
+    client.events = EventBuffer()
+    pipeline = FramePipeline(
+        client.decode_frame, client.commit_frame, max_frames=num * 5
+    )
+    put_ns = measure(lambda: pipeline.put(frame), num)
+    pipeline.join()
+    logging.info(
+        f"frames: 10 events | inline decode {decode_ns:6.0f} ns | "
+        f"pipeline put {put_ns:6.0f} ns | {pipeline.get_stats()}"
+    )
+
+
+def parsed_sign(privkey, message):
+    """
+    Previous signing, parsing the private key for every signature
+    """
+    key = ecdsa.SigningKey.from_string(bytes.fromhex(privkey), curve=ecdsa.SECP256k1)
+    return key.sign_deterministic(
+        message,
+        hashfunc=hashlib.sha256,
+        sigencode=ecdsa.util.sigencode_string_canonize,
+    )
+
+
+def bench_sign(num):
+    """
+    Signatures per second of the previous signing and of every key ring backend
+    """
+    # curve math is slow, keep the run short
+    num = min(num, 200)
+    message = json.dumps({"chain_id": "thorchain", "msgs": ["x" * 200]}).encode()
+    privkey = MockThorchain.private_keys["USER-1"]
+    parsed_ns = measure(lambda: parsed_sign(privkey, message), num)
+    logging.info(f"sign: parse every time | {1e9 / parsed_ns:8.0f} sig/s")
+    for name, backend in BACKENDS.items():
+        keys = KeyRing(MockThorchain.private_keys, backend)
+        signature = keys.sign("USER-1", message)
+        sign_ns = measure(lambda: keys.sign("USER-1", message), num)
+        verify_ns = measure(lambda: keys.verify("USER-1", message, signature), num)
+        logging.info(
+            f"sign: {name:>9} key ring | {1e9 / sign_ns:8.0f} sig/s | "
+            f"verify {1e9 / verify_ns:8.0f} sig/s | x{parsed_ns / sign_ns:.1f}"
+        )
+
+
+BENCHES = {
+    "pools": bench_pools,
+    "stakers": bench_stakers,
+    "swap": bench_swap,
+    "math": bench_math,
+    "quote": bench_quote,
+    "events": bench_events,
+    "buffer": bench_buffer,
+    "frames": bench_frames,
+    "sign": bench_sign,
+}
+
+
+if __name__ == "__main__":
+    main()
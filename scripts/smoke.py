@@ -1,9 +1,9 @@
 import argparse
-import time
 import logging
 import os
 import sys
 import json
+import time
 
 from tenacity import retry, stop_after_delay, wait_fixed
 
@@ -12,7 +12,7 @@ from chains.binance import Binance, MockBinance
 from chains.bitcoin import Bitcoin, MockBitcoin
 from chains.ethereum import Ethereum, MockEthereum
 from chains.thorchain import Thorchain, MockThorchain
-from thorchain.thorchain import ThorchainState, ThorchainClient
+from thorchain.thorchain import ThorchainState, ThorchainClient, EventReconciler
 from scripts.health import Health
 from utils.common import Transaction, Coin, Asset, get_rune_asset
 from chains.aliases import aliases_bnb, get_alias
@@ -160,7 +160,8 @@ class Smoker:
         self.no_verify = no_verify
         self.bitcoin_reorg = bitcoin_reorg
         self.ethereum_reorg = ethereum_reorg
-        self.thorchain_client.events = []
+        self.thorchain_client.events.clear()
+        self.reconciler = EventReconciler()
         self.exit = 0
 
     def error(self, err):
@@ -207,13 +208,19 @@ class Smoker:
 
     def check_chain(self, chain, mock, reorg):
         # compare simulation bitcoin vs mock bitcoin
+        accounts = []
         for addr, sim_acct in chain.accounts.items():
             name = get_alias(chain.chain, addr)
             if name == "MASTER":
                 continue  # don't care to compare MASTER account
             if name == "VAULT" and chain.chain == "THOR":
                 continue  # don't care about vault for thorchain
-            mock_coin = Coin(chain.coin, mock.get_balance(addr))
+            accounts.append((addr, name, sim_acct))
+
+        # fetch every balance at once
+        balances = mock.get_balances([addr for addr, _, _ in accounts])
+        for addr, name, sim_acct in accounts:
+            mock_coin = Coin(chain.coin, balances[addr])
             sim_coin = Coin(chain.coin, sim_acct.get(chain.coin))
             # dont raise error on reorg balance being invalidated
             # sim is not smart enough to subtract funds on reorg
@@ -236,17 +243,25 @@ class Smoker:
             real = vdata["bond_reward_rune"]
             self.error(f"Mismatching bond reward: {sim} != {real}")
 
+    def reconcile_events(self):
+        """
+        Absorb new real and simulated events, returns if all events match
+        """
+        self.reconciler.sync(
+            self.thorchain_client.events.log, self.thorchain_state.events
+        )
+        return self.reconciler.is_matched()
+
     def check_events(self):
-        events = self.thorchain_client.events
-        sim_events = self.thorchain_state.events
-
-        for event, sim_event in zip(sorted(events), sorted(sim_events)):
-            if sim_event != event:
-                logging.error(
-                    f"Event Thorchain \n{event}\n   !="
-                    f"  \nEvent Simulator \n{sim_event}"
-                )
-                self.error("Events mismatch")
+        if self.reconcile_events():
+            return
+
+        events, sim_events = self.reconciler.unmatched()
+        for event in events:
+            logging.error(f"Event Thorchain without simulator match \n{event}")
+        for sim_event in sim_events:
+            logging.error(f"Event Simulator without thorchain match \n{sim_event}")
+        self.error("Events mismatch")
 
     @retry(stop=stop_after_delay(30), wait=wait_fixed(1), reraise=True)
     def run_health(self):
@@ -312,13 +327,16 @@ class Smoker:
         count_outbounds = 0
         processed_outbound_events = False
 
-        for x in range(0, 30):  # 30 attempts
-            events = self.thorchain_client.events[:]
-            sim_events = self.thorchain_state.events[:]
+        # bounded in time, event arrivals don't use up the budget
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            count_events = len(self.thorchain_client.events)
+            count_sim_events = len(self.thorchain_state.events)
 
             # we have more real events than sim, fill in the gaps
-            if len(events) > len(sim_events):
-                for evt in events[len(sim_events) :]:
+            if count_events > count_sim_events:
+                events = self.thorchain_client.events
+                for evt in events[count_sim_events:count_events]:
                     if evt.type == "gas" and count_outbounds > 0:
                         todo = []
                         # with the given gas pool event data, figure out
@@ -360,22 +378,21 @@ class Smoker:
                 outbounds, count_outbounds = self.sim_trigger_tx(txn)
                 processed_transaction = True
                 # still need to wait for thorchain to process it
-                time.sleep(5)
+                self.thorchain_client.wait_for_events(count_events + 1, timeout=5)
                 continue
 
+            matched = self.reconcile_events()
+
             # happy path exit
-            if (
-                sorted(events) == sorted(sim_events)
-                and count_outbounds <= 0
-                and processed_transaction
-            ):
+            if matched and count_outbounds <= 0 and processed_transaction:
                 break
 
             # not happy path exit, we got wrong events
-            if len(events) == len(sim_events) and sorted(events) != sorted(sim_events):
+            reconciler = self.reconciler
+            if reconciler.real_cursor == reconciler.sim_cursor and not matched:
                 break
 
-            time.sleep(1)
+            self.thorchain_client.wait_for_events(count_events + 1, timeout=1)
 
         if count_outbounds > 0:
             self.error(
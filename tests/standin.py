@@ -0,0 +1,55 @@
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Base handler of the local stand-ins of json apis,
+    subclasses only route the requests with do_GET/do_POST
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def read_json(self):
+        return json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+    def reply(self, data, status=200, headers={}):
+        """
+        Answer with data encoded as json, or as is when already bytes
+        """
+        body = data if isinstance(data, bytes) else json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        try:
+            self.end_headers()
+            self.wfile.write(body)
+        except BrokenPipeError:
+            pass  # client timed out
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Stand-in server listening on a free local port, serving from a
+    background thread. Keyword arguments are set on the server as the
+    state its handlers read and update.
+    """
+
+    def __init__(self, handler, **state):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.lock = threading.Lock()
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.url = f"http://127.0.0.1:{self.server_port}"
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,65 @@
+import unittest
+
+from decimal import getcontext
+
+from utils.amm import (
+    div_round,
+    get_share,
+    calc_asset_emission,
+    calc_liquidity_fee,
+    calc_trade_slip,
+    calc_stake_units,
+)
+
+
+class TestAmm(unittest.TestCase):
+    def test_div_round(self):
+        self.assertEqual(div_round(10, 4), 2)
+        self.assertEqual(div_round(14, 4), 4)
+        self.assertEqual(div_round(11, 4), 3)
+        self.assertEqual(div_round(9, 4), 2)
+        self.assertEqual(div_round(-10, 4), -2)
+        self.assertEqual(div_round(-14, 4), -4)
+        self.assertEqual(div_round(10, -4), -2)
+
+    def test_get_share(self):
+        self.assertEqual(get_share(149506590, 50165561086, 50000000), 149013)
+        self.assertEqual(get_share(0, 50165561086, 50000000), 0)
+        self.assertEqual(get_share(149506590, 0, 50000000), 0)
+        self.assertEqual(get_share(1, 6 * 6311390, 40001517380253), 1056331)
+        # does not depend on the global decimal context
+        prec = getcontext().prec
+        getcontext().prec = 3
+        try:
+            self.assertEqual(get_share(149506590, 50165561086, 50000000), 149013)
+        finally:
+            getcontext().prec = prec
+
+    def test_calc_asset_emission(self):
+        emit = calc_asset_emission(5000000000, 1000000000, 5000000000)
+        self.assertEqual(emit, 694444444)
+        # exact even where float division would lose precision
+        emit = calc_asset_emission(10 ** 30, 10 ** 20, 10 ** 30)
+        self.assertEqual(emit, 99999999980000000002)
+
+    def test_calc_liquidity_fee(self):
+        self.assertEqual(calc_liquidity_fee(94382619747, 100001000, 301902607), 338)
+        self.assertEqual(
+            calc_liquidity_fee(10000000000, 1000000000, 10000000000), 82644628
+        )
+
+    def test_calc_trade_slip(self):
+        self.assertEqual(calc_trade_slip(10000000000, 1000000000), 2100)
+        self.assertEqual(calc_trade_slip(94405967833, 10000000000), 2231)
+
+    def test_calc_stake_units(self):
+        units = calc_stake_units(0, 0, 0, 34500000000, 23400000000)
+        self.assertEqual(units, 34500000000)
+        units = calc_stake_units(
+            34500000000, 50000000000, 40000000000, 50000000000, 40000000000
+        )
+        self.assertEqual(units, 34500000000)
+
+
+if __name__ == "__main__":
+    unittest.main()
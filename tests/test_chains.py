@@ -1,9 +1,32 @@
+import base64
+import ecdsa
+import hashlib
+import json
+import requests
+import threading
+import time
 import unittest
 
 from chains.account import Account
-from chains.binance import Binance
+from chains.binance import Binance, MockBinance, encode_coin
+from chains.chain import HeadWatcher, head_watcher
+from bitcoin.core import CTransaction, b2lx, x
+from chains.bitcoin import MockBitcoin, BitcoinRpcError, UtxoPool
+from chains.ethereum import MockEthereum, calculate_gas
+from chains.thorchain import (
+    MockThorchain,
+    KeyRing,
+    BACKENDS,
+    generate_wallet,
+    get_backend,
+    privkey_to_address,
+)
 
-from utils.common import Transaction, Coin, get_rune_asset
+from utils.common import Transaction, Coin, RetryPolicy, get_rune_asset
+from chains.aliases import get_alias_address
+from utils.segwit_addr import address_from_public_key, decode_address
+from tests.standin import StandInHandler, StandInServer
+from decimal import Decimal
 
 RUNE = get_rune_asset()
 
@@ -22,6 +45,50 @@ class TestAccount(unittest.TestCase):
         self.assertEqual(acct.get(RUNE), 0)
 
 
+class TestHeadWatcher(unittest.TestCase):
+    def test_wait(self):
+        chain = {"height": 10, "polls": 0}
+
+        def get_height():
+            # a block every 5 polls
+            chain["polls"] += 1
+            if chain["polls"] % 5 == 0:
+                chain["height"] += 1
+            return chain["height"]
+
+        watcher = HeadWatcher(min_interval=0.01, max_interval=0.05)
+        head = watcher.watch("test", get_height)
+        self.assertIs(watcher.watch("test", None), head)
+        self.assertIsNone(head.height)
+
+        self.assertTrue(head.wait_for_height(11, timeout=5))
+        self.assertTrue(head.wait_for_blocks(2, timeout=5))
+        self.assertGreaterEqual(head.height, 13)
+        self.assertFalse(head.wait_for_height(1000, timeout=0.1))
+
+        # many waiters share the same poller
+        polls = chain["polls"]
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(head.wait_for_blocks(1, timeout=5))
+            )
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * 10)
+        self.assertLess(chain["polls"] - polls, 30)
+        self.assertIsNotNone(head.block_time)
+
+        stats = watcher.get_stats()["test"]
+        self.assertLessEqual(stats["polls"], chain["polls"])
+        self.assertEqual(stats["errors"], 0)
+        watcher.stop()
+
+
 class TestBinance(unittest.TestCase):
     def test_gas(self):
         bnb = Binance()
@@ -59,5 +126,565 @@ class TestBinance(unittest.TestCase):
         self.assertEqual(from_acct.get("BNB.BNB"), 99962500)
 
 
+class StandInMockBinance(StandInHandler):
+    """
+    Local stand-in of mock binance, every 2 broadcasts share a block
+    which also holds a tx of another sender with the same memo and coins.
+    Txs with the rejected memo are left out of the blocks.
+    """
+
+    def raw_tx(self, tx, nonce):
+        coins = b"".join(encode_coin(**coin) for coin in tx["coins"])
+        raw = decode_address(tx["from"]) + coins + decode_address(tx["to"]) + coins
+        return b"tx" + raw + tx["memo"].encode() + bytes([nonce])
+
+    def do_POST(self):
+        server = self.server
+        payload = self.read_json()
+        if server.posts % 2 == 0:
+            server.height += 1
+            other = self.raw_tx({**payload[0], "from": server.other}, 0)
+            server.blocks[server.height] = [other]
+        server.posts += 1
+        for tx in payload:
+            if tx["memo"] == server.rejected:
+                continue
+            server.nonce += 1
+            raw = self.raw_tx(tx, server.nonce)
+            server.blocks[server.height].append(raw)
+            server.sent.append(raw)
+        self.reply({"height": str(server.height)})
+
+    def do_GET(self):
+        height = int(self.path.split("height=")[1])
+        self.server.fetches += 1
+        txs = [base64.b64encode(raw).decode() for raw in self.server.blocks[height]]
+        self.reply({"result": {"block": {"data": {"txs": txs}}}})
+
+
+class TestMockBinance(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(
+            StandInMockBinance,
+            height=0,
+            posts=0,
+            nonce=0,
+            fetches=0,
+            blocks={},
+            sent=[],
+            rejected=None,
+            other=address_from_public_key(b"other"),
+        )
+        self.addCleanup(self.server.close)
+        self.binance = MockBinance(self.server.url)
+        self.sender = address_from_public_key(b"sender")
+
+    def txid(self, raw):
+        return hashlib.sha256(raw).hexdigest().upper()
+
+    def test_transfer(self):
+        txn = Transaction("BNB", self.sender, self.sender, Coin("BNB.BNB", 1), "SEED")
+        self.binance.transfer(txn)
+        # the block holds another tx first, matched by sender
+        self.assertEqual(txn.id, self.txid(self.server.sent[0]))
+
+    def test_transfer_shared_block(self):
+        # as many txs in the block as broadcasted, but one is of another sender
+        self.server.rejected = "REJECTED"
+        txns = [
+            Transaction("BNB", self.sender, self.sender, Coin("BNB.BNB", 1), "SEED"),
+            Transaction(
+                "BNB", self.sender, self.sender, Coin("BNB.BNB", 200), "REJECTED"
+            ),
+        ]
+        with self.assertLogs(level="WARNING"):
+            self.binance.transfer(txns)
+        self.assertEqual(len(self.server.blocks[1]), 2)
+        self.assertEqual(txns[0].id, self.txid(self.server.sent[0]))
+        self.assertEqual(txns[1].id, "TODO")
+
+    def test_transfer_bulk(self):
+        txns = [
+            Transaction(
+                "BNB", self.sender, self.sender, Coin("BNB.BNB", i + 1), "SWAP:BNB.BNB"
+            )
+            for i in range(7)
+        ]
+        blocks = self.binance.transfer_bulk(txns, chunk_size=2)
+
+        self.assertEqual(self.server.posts, 4)
+        self.assertEqual({h: len(t) for h, t in blocks.items()}, {1: 4, 2: 3})
+        self.assertEqual(self.server.fetches, 2)
+        self.assertEqual(
+            [txn.id for txn in txns], [self.txid(raw) for raw in self.server.sent]
+        )
+
+
+class TestKeyRing(unittest.TestCase):
+    def test_sign(self):
+        keys = KeyRing(MockThorchain.private_keys, get_backend("ecdsa"))
+        self.assertIs(keys.get("USER-1"), keys.get("USER-1"))
+        message = b'{"chain_id":"thorchain"}'
+        signature = keys.sign("USER-1", message)
+        self.assertEqual(len(signature), 64)
+        self.assertTrue(keys.verify("USER-1", message, signature))
+        self.assertFalse(keys.verify("STAKER-1", message, signature))
+        self.assertFalse(keys.verify("USER-1", message + b" ", signature))
+
+        # same signature as parsing the key for every signature
+        privkey = ecdsa.SigningKey.from_string(
+            bytes.fromhex(MockThorchain.private_keys["USER-1"]), curve=ecdsa.SECP256k1
+        )
+        expected = privkey.sign_deterministic(
+            message,
+            hashfunc=hashlib.sha256,
+            sigencode=ecdsa.util.sigencode_string_canonize,
+        )
+        self.assertEqual(signature, expected)
+        self.assertEqual(
+            keys.public_key("USER-1"),
+            privkey.get_verifying_key().to_string("compressed").hex(),
+        )
+
+        address = privkey_to_address(MockThorchain.private_keys["USER-1"])
+        self.assertEqual(address, get_alias_address("THOR", "USER-1"))
+        wallet = generate_wallet()
+        self.assertEqual(len(wallet["public_key"]), 66)
+        self.assertTrue(wallet["address"].startswith("tthor"))
+
+    @unittest.skipIf("secp256k1" not in BACKENDS, "coincurve not installed")
+    def test_backends(self):
+        message = b'{"chain_id":"thorchain"}'
+        slow = KeyRing(MockThorchain.private_keys, get_backend("ecdsa"))
+        fast = KeyRing(MockThorchain.private_keys, get_backend("secp256k1"))
+        for name in MockThorchain.private_keys:
+            signature = fast.sign(name, message)
+            self.assertEqual(signature, slow.sign(name, message))
+            self.assertEqual(fast.public_key(name), slow.public_key(name))
+            self.assertTrue(fast.verify(name, message, signature))
+
+
+class StandInThornode(StandInHandler):
+    """
+    Local stand-in of the thorchain api, a tx is accepted only when it
+    carries the next sequence of its account
+    """
+
+    def do_GET(self):
+        address = self.path.rsplit("/", 1)[1]
+        self.server.fetches += 1
+        seq = self.server.sequences.setdefault(address, 3)
+        value = {"account_number": "7", "sequence": str(seq), "coins": []}
+        self.reply({"result": {"value": value}})
+
+    def do_POST(self):
+        server = self.server
+        payload = self.read_json()
+        if self.path == "/thorchain/native/tx":
+            server.builds += 1
+            msg = {"type": "thorchain/MsgNativeTx", "value": payload}
+            fee = {"amount": [], "gas": "100000000"}
+            return self.reply({"value": {"msg": [msg], "fee": fee}})
+
+        address = payload["tx"]["msg"][0]["value"]["base_req"]["from"]
+        seq = int(payload["tx"]["signatures"][0]["sequence"])
+        txhash = hashlib.sha256(json.dumps(payload).encode()).hexdigest().upper()
+        with server.lock:
+            if seq != server.sequences[address]:
+                failed = {"txhash": txhash, "code": 4, "raw_log": "signature failed"}
+                return self.reply(failed)
+            server.sequences[address] += 1
+            server.accepted.append((address, seq))
+        self.reply({"txhash": txhash})
+
+
+class TestMockThorchain(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(
+            StandInThornode, fetches=0, builds=0, sequences={}, accepted=[]
+        )
+        self.addCleanup(self.server.close)
+        self.thorchain = MockThorchain(self.server.url)
+
+    def txn(self, sender, amount):
+        return Transaction("THOR", sender, "VAULT", Coin(RUNE, amount), "SWAP:BNB.BNB")
+
+    def test_transfer(self):
+        txns = [self.txn("USER-1", 1), self.txn("USER-1", 2)]
+        self.thorchain.transfer(txns)
+        address = txns[0].from_address
+        self.assertEqual(self.server.accepted, [(address, 3), (address, 4)])
+        self.assertEqual(self.server.fetches, 1)
+        self.assertNotEqual(txns[0].id, txns[1].id)
+
+        # sequence moved by someone else, refetched after the rejection
+        self.server.sequences[address] = 10
+        self.thorchain.transfer(self.txn("USER-1", 3))
+        self.thorchain.transfer(self.txn("USER-1", 4))
+        self.assertEqual(self.server.accepted[-1], (address, 10))
+        self.assertEqual(self.server.fetches, 2)
+
+    def test_transfer_pipelined(self):
+        txns = [
+            self.txn(sender, 1)
+            for _ in range(10)
+            for sender in ["USER-1", "STAKER-1", "STAKER-2"]
+        ]
+        stats = self.thorchain.transfer_pipelined(txns)
+        self.assertEqual(stats["sent"], 30)
+        self.assertEqual(stats["rejected"], 0)
+        self.assertEqual(len(self.server.accepted), 30)
+        self.assertEqual(self.server.builds, 3)
+        self.assertEqual(self.server.fetches, 3)
+        self.assertTrue(all(txn.id for txn in txns))
+
+        # a rejection skips the next txs of the account only
+        address = txns[0].from_address
+        self.server.sequences[address] += 1
+        stats = self.thorchain.transfer_pipelined(txns[:6])
+        self.assertEqual(stats["sent"], 4)
+        self.assertEqual(stats["rejected"], 1)
+        self.assertEqual(stats["skipped"], 1)
+
+
+class StandInBitcoind(StandInHandler):
+    """
+    Local stand-in of a regtest bitcoind json rpc server,
+    answering from the unspents of the server and recording the
+    transactions sent, a raw transaction created here is its json.
+    Batches of more than batch_limit calls are rejected as a whole.
+    """
+
+    def do_POST(self):
+        payload = self.read_json()
+        self.server.requests.append(payload)
+        if isinstance(payload, list) and len(payload) > self.server.batch_limit:
+            error = {"code": -32600, "message": "Batch too large"}
+            result = {"id": None, "result": None, "error": error}
+        elif isinstance(payload, list):
+            result = [self.rpc(call) for call in payload]
+        else:
+            result = self.rpc(payload)
+        self.reply(result)
+
+    def rpc(self, call):
+        response = {"id": call.get("id"), "result": None, "error": None}
+        params = call["params"]
+        if call["method"] == "importprivkey":
+            self.server.keys.append(params[0])
+        elif call["method"] == "getblockcount":
+            response["result"] = 101
+        elif call["method"] == "listunspent":
+            response["result"] = [
+                u for u in self.server.unspents if u["address"] in params[2]
+            ]
+        elif call["method"] == "createrawtransaction":
+            response["result"] = json.dumps(params).encode().hex()
+        elif call["method"] == "signrawtransactionwithwallet":
+            response["result"] = {"hex": params[0], "complete": True}
+        elif call["method"] == "sendrawtransaction":
+            self.server.sent.append(params[0])
+            response["result"] = hashlib.sha256(params[0].encode()).hexdigest()
+        else:
+            response["error"] = {"code": -32601, "message": "Method not found"}
+        return response
+
+
+class TestUtxoPool(unittest.TestCase):
+    def test_load_confirms(self):
+        pool = UtxoPool()
+        pool.add("A", "tx1", 1, "1.0", depth=UtxoPool.max_depth)
+        self.assertIsNone(pool.reserve("A", Decimal("0.1")))
+
+        # listed by the node, the output is confirmed and spendable again
+        pool.load("A", [{"txid": "tx1", "vout": 1, "amount": 1.0}])
+        utxo = pool.reserve("A", Decimal("0.1"))
+        self.assertEqual((utxo["txid"], utxo["depth"]), ("tx1", 0))
+        self.assertEqual(utxo["amount"], Decimal("1.0"))
+
+
+class TestMockBitcoin(unittest.TestCase):
+    def setUp(self):
+        unspents = [
+            {"address": "bcrt1a", "txid": "A", "vout": 0, "amount": 0.5},
+            {"address": "bcrt1b", "txid": "A", "vout": 1, "amount": 0.25},
+            {"address": "bcrt1a", "txid": "B", "vout": 0, "amount": 0.00000001},
+        ]
+        self.server = StandInServer(
+            StandInBitcoind,
+            requests=[],
+            keys=[],
+            sent=[],
+            unspents=unspents,
+            batch_limit=100,
+        )
+        self.addCleanup(self.server.close)
+        self.base_url = self.server.url
+
+    def test_call_batch(self):
+        bitcoin = MockBitcoin(self.base_url)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(len(self.server.keys), len(MockBitcoin.private_keys))
+
+        results = bitcoin.call_batch(
+            [("getblockcount",), ("unknown", 1), ("listunspent", 1, 9999, ["bcrt1b"])]
+        )
+        self.assertEqual(results[0], 101)
+        self.assertIsInstance(results[1], BitcoinRpcError)
+        self.assertEqual(results[1].code, -32601)
+        self.assertEqual(results[2][0]["txid"], "A")
+        self.assertEqual(bitcoin.call_batch([]), [])
+        self.assertEqual(len(self.server.requests), 2)
+
+        # a rejected batch fails as a whole
+        self.server.batch_limit = 2
+        with self.assertRaises(BitcoinRpcError) as cm:
+            bitcoin.call_batch([("getblockcount",)] * 3)
+        self.assertEqual(cm.exception.code, -32600)
+
+    def test_get_balances(self):
+        bitcoin = MockBitcoin(self.base_url)
+        balances = bitcoin.get_balances(["bcrt1a", "bcrt1b", "bcrt1c"])
+        expected = {"bcrt1a": 50000001, "bcrt1b": 25000000, "bcrt1c": 0}
+        self.assertEqual(balances, expected)
+        request = self.server.requests[-1]
+        self.assertEqual(request["method"], "listunspent")
+        self.assertEqual(request["params"][2], ["bcrt1a", "bcrt1b", "bcrt1c"])
+        self.assertEqual(bitcoin.get_balance("bcrt1b"), 25000000)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(bitcoin.get_balances([]), {})
+
+    def listunspent_count(self):
+        return sum(
+            1
+            for request in self.server.requests
+            if not isinstance(request, list) and request["method"] == "listunspent"
+        )
+
+    def test_transfer(self):
+        bitcoin = MockBitcoin(self.base_url)
+
+        def transfer(amount):
+            txn = Transaction(
+                "BTC", "bcrt1a", "bcrt1vault", Coin("BTC.BTC", amount), "ADD:BTC.BTC"
+            )
+            bitcoin.transfer(txn)
+            tx_in, tx_out = json.loads(bytes.fromhex(self.server.sent[-1]))
+            return txn, tx_in, tx_out
+
+        txn, tx_in, tx_out = transfer(10000000)
+        self.assertEqual(tx_in, [{"txid": "A", "vout": 0}])
+        self.assertEqual(tx_out[0], {"bcrt1vault": 0.1})
+        self.assertEqual(list(tx_out[1]), ["bcrt1a"])
+
+        # the change is spent next without asking the node again
+        txn2, tx_in, tx_out = transfer(10000000)
+        self.assertEqual(tx_in, [{"txid": txn.id.lower(), "vout": 1}])
+        self.assertEqual(self.listunspent_count(), 1)
+        self.assertEqual(bitcoin.utxos.count("bcrt1a"), 2)
+
+        # spent outputs still listed by the node are not used again
+        with self.assertRaises(Exception):
+            transfer(100000000)
+        self.assertEqual(self.listunspent_count(), 2)
+        self.assertEqual(len(self.server.sent), 2)
+
+    def test_transfer_dust_change(self):
+        bitcoin = MockBitcoin(self.base_url)
+        self.server.unspents.append(
+            {"address": "bcrt1c", "txid": "C", "vout": 0, "amount": 0.110001}
+        )
+        txn = Transaction(
+            "BTC", "bcrt1c", "bcrt1vault", Coin("BTC.BTC", 10000000), "ADD:BTC.BTC"
+        )
+        bitcoin.transfer(txn)
+        tx_in, tx_out = json.loads(bytes.fromhex(self.server.sent[-1]))
+        # the 100 sat change is left to the fee instead of a dust output
+        self.assertEqual(tx_out[0], {"bcrt1vault": 0.1})
+        self.assertEqual(list(tx_out[1]), ["data"])
+        self.assertEqual(txn.gas, [Coin("BTC.BTC", MockBitcoin.default_gas + 100)])
+        self.assertEqual(bitcoin.utxos.count("bcrt1c"), 0)
+
+    def test_split_utxos(self):
+        bitcoin = MockBitcoin(self.base_url)
+        address = MockBitcoin.get_address_from_pubkey(bytes.fromhex("02" + "11" * 32))
+        self.server.unspents.append(
+            {"address": address, "txid": "C" * 64, "vout": 3, "amount": 1}
+        )
+
+        txid = bitcoin.split_utxos(address, 10, 2000000)
+        tx = CTransaction.deserialize(x(self.server.sent[-1]))
+        self.assertEqual(b2lx(tx.vin[0].prevout.hash), "c" * 64)
+        self.assertEqual(tx.vin[0].prevout.n, 3)
+        fee = MockBitcoin.estimate_fee(1, 11)
+        self.assertGreater(fee, MockBitcoin.default_gas)
+        change = 100000000 - 10 * 2000000 - fee
+        self.assertEqual([out.nValue for out in tx.vout], [2000000] * 10 + [change])
+        self.assertEqual(bitcoin.utxos.count(address), 11)
+
+        inputs = set()
+        for i in range(10):
+            txn = Transaction(
+                "BTC", address, "bcrt1vault", Coin("BTC.BTC", 500000), "ADD:BTC.BTC"
+            )
+            bitcoin.transfer(txn)
+            tx_in, tx_out = json.loads(bytes.fromhex(self.server.sent[-1]))
+            inputs.add((tx_in[0]["txid"], tx_in[0]["vout"]))
+            self.assertEqual(Decimal(str(tx_out[1][address])), Decimal("0.005"))
+        self.assertEqual(inputs, {(txid, vout) for vout in range(10)})
+        self.assertEqual(self.listunspent_count(), 1)
+
+    def test_split_utxos_fee(self):
+        bitcoin = MockBitcoin(self.base_url)
+        address = MockBitcoin.get_address_from_pubkey(bytes.fromhex("02" + "11" * 32))
+
+        # the fee grows with the outputs of a wide split
+        self.server.unspents.append(
+            {"address": address, "txid": "C" * 64, "vout": 0, "amount": 10}
+        )
+        bitcoin.split_utxos(address, 500, 1000000)
+        tx = CTransaction.deserialize(x(self.server.sent[-1]))
+        fee = 10 * Coin.ONE - sum(out.nValue for out in tx.vout)
+        self.assertEqual(fee, MockBitcoin.estimate_fee(1, 501))
+        self.assertEqual(len(tx.vout), 501)
+
+        # dust change is left to the fee instead of an output
+        fee = MockBitcoin.estimate_fee(1, 3)
+        amount = Decimal(2 * 1000000 + fee + 100) / Coin.ONE
+        self.server.unspents = [
+            {"address": address, "txid": "D" * 64, "vout": 0, "amount": float(amount)}
+        ]
+        bitcoin.utxos.clear()
+        bitcoin.split_utxos(address, 2, 1000000)
+        tx = CTransaction.deserialize(x(self.server.sent[-1]))
+        self.assertEqual([out.nValue for out in tx.vout], [1000000] * 2)
+        self.assertEqual(bitcoin.utxos.count(address), 2)
+
+
+class StandInGeth(StandInHandler):
+    """
+    Local stand-in of a geth json rpc server, every request for the latest
+    block mines a new one holding up to 3 of the pending transactions
+    """
+
+    def do_POST(self):
+        payload = self.read_json()
+        if isinstance(payload, list):
+            self.server.batches += 1
+            time.sleep(self.server.stall)
+            result = [self.rpc(call) for call in payload]
+        else:
+            result = self.rpc(payload)
+        self.reply(result)
+
+    def rpc(self, call):
+        response = {"jsonrpc": "2.0", "id": call.get("id"), "result": None}
+        method, params = call["method"], call["params"]
+        server = self.server
+        if method == "eth_getBlockByNumber":
+            if params[0] == "latest":
+                server.height += 1
+                mined, server.mempool = server.mempool[:3], server.mempool[3:]
+                for i, tx_hash in enumerate(mined):
+                    server.receipts[tx_hash] = {
+                        "transactionHash": tx_hash,
+                        "blockNumber": hex(server.height),
+                        "blockHash": "0x" + "00" * 32,
+                        "gasUsed": hex(server.txs[tx_hash]["gas"]),
+                        "cumulativeGasUsed": hex(21000 * (i + 1)),
+                    }
+            response["result"] = {
+                "number": hex(server.height),
+                "hash": "0x" + "00" * 32,
+                "extraData": "0x",
+            }
+        elif method == "eth_getTransactionCount":
+            response["result"] = hex(5)
+        elif method == "personal_sendTransaction":
+            tx = params[0]
+            tx_hash = "0x" + hashlib.sha256(json.dumps(tx).encode()).hexdigest()
+            nonce, gas = int(tx["nonce"], 16), int(tx["gas"], 16)
+            server.txs[tx_hash] = {"nonce": nonce, "gas": gas}
+            server.mempool.append(tx_hash)
+            response["result"] = tx_hash
+        elif method == "eth_getTransactionReceipt":
+            response["result"] = server.receipts.get(params[0])
+        return response
+
+
+class TestMockEthereum(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(
+            StandInGeth,
+            height=10,
+            batches=0,
+            stall=0,
+            txs={},
+            mempool=[],
+            receipts={},
+        )
+        self.addCleanup(self.server.close)
+        self.addCleanup(head_watcher.stop)
+        self.base_url = self.server.url
+
+    def test_transfer(self):
+        ethereum = MockEthereum(self.base_url)
+        txn = Transaction(
+            "ETH", "0x" + "11" * 20, "0x" + "22" * 20, Coin("ETH.ETH", 1), "MEMO:1"
+        )
+        # mine the block of the transfer while it waits for its receipt
+        miner = threading.Timer(0.2, ethereum.web3.eth.getBlock, args=("latest",))
+        miner.start()
+        self.addCleanup(miner.cancel)
+        ethereum.transfer(txn)
+        self.assertIn(f"0x{txn.id.lower()}", self.server.receipts)
+        # gas of the transaction alone, not of the block up to it
+        self.assertEqual(txn.gas, [Coin("ETH.ETH", calculate_gas(txn.memo))])
+
+    def test_transfer_pipelined(self):
+        ethereum = MockEthereum(self.base_url)
+        sender = "0x" + "11" * 20
+        txns = [
+            Transaction(
+                "ETH", sender, "0x" + "22" * 20, Coin("ETH.ETH", i + 1), f"MEMO:{i}"
+            )
+            for i in range(7)
+        ]
+        latencies = ethereum.transfer_pipelined(txns)
+
+        nonces = sorted(tx["nonce"] for tx in self.server.txs.values())
+        self.assertEqual(nonces, list(range(5, 12)))
+        self.assertEqual(len(self.server.receipts), 7)
+        # one batch per new block seen, the head watcher may skip some
+        self.assertLessEqual(self.server.batches, 3)
+        for txn in txns:
+            self.assertIn(f"0x{txn.id.lower()}", self.server.receipts)
+            self.assertEqual(txn.gas, [Coin("ETH.ETH", calculate_gas(txn.memo))])
+        blocks = sorted(b for _, b in latencies.values())
+        self.assertEqual(len(blocks), 7)
+        self.assertGreaterEqual(blocks[0], 1)
+        self.assertGreaterEqual(blocks[-1], 3)
+
+        # next sends carry on with the local nonces until reset
+        tx_hash = ethereum.send(ethereum.prepare(txns[0])).hex()
+        self.assertEqual(self.server.txs[tx_hash]["nonce"], 12)
+        ethereum.nonces.reset()
+        tx_hash = ethereum.send(ethereum.prepare(txns[1])).hex()
+        self.assertEqual(self.server.txs[tx_hash]["nonce"], 5)
+
+    def test_call_batch_timeout(self):
+        policy = RetryPolicy(retries=1, backoff_factor=0, timeout=0.2, deadline=1)
+        ethereum = MockEthereum(self.base_url, policy=policy)
+        calls = [("eth_getTransactionReceipt", ["0x00"])]
+        self.assertEqual(ethereum.call_batch(calls), [None])
+
+        # a stalled node fails the call instead of hanging
+        self.server.stall = 1
+        start = time.monotonic()
+        with self.assertRaises(requests.RequestException):
+            ethereum.call_batch(calls)
+        self.assertLess(time.monotonic() - start, 1)
+
+
 if __name__ == "__main__":
     unittest.main()
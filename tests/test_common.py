@@ -1,16 +1,31 @@
+import asyncio
+import threading
+import time
 import unittest
 import json
 
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 from copy import deepcopy
+from decimal import Decimal
+from requests import RequestException
+from requests.exceptions import RetryError
 from utils.common import (
+    AsyncHttpClient,
+    CircuitOpenError,
+    HttpClient,
+    RetryPolicy,
+    SingleFlight,
     Asset,
     Transaction,
     Coin,
     get_share,
+    get_policy,
     get_rune_asset,
     DEFAULT_RUNE_ASSET,
 )
 from chains.binance import Binance
+from tests.standin import StandInHandler, StandInServer
 
 RUNE = get_rune_asset()
 
@@ -361,6 +376,27 @@ class TestTransaction(unittest.TestCase):
         list2[0].coins = None
         self.assertEqual(list1, list2)
 
+    def test_copy(self):
+        txn = Transaction(
+            Binance.chain,
+            "USER",
+            "VAULT",
+            [Coin("BNB.BNB", 100), Coin(RUNE, 200)],
+            "SWAP:BNB.BNB",
+            gas=[Coin("BNB.BNB", 37500)],
+            id="9999A5A08D8FCF942E1AAAA01AB1E521B699BA3A009FA0591C011DC1FFDC5E68",
+        )
+        copy = txn.copy()
+        self.assertEqual(copy, txn)
+        self.assertEqual(copy.id, txn.id)
+        copy.coins[0].amount = 0
+        copy.coins[1] = Coin(RUNE, 300)
+        copy.gas = None
+        self.assertEqual(txn.coins, [Coin("BNB.BNB", 100), Coin(RUNE, 200)])
+        self.assertEqual(txn.gas, [Coin("BNB.BNB", 37500)])
+        txn.coins = None
+        self.assertEqual(txn.copy().coins, None)
+
     def test_custom_hash(self):
         txn = Transaction(
             Binance.chain,
@@ -459,5 +495,334 @@ class TestTransaction(unittest.TestCase):
         self.assertEqual(txn.gas[0].amount, 37500)
 
 
+class StandInApi(StandInHandler):
+    """
+    Local stand-in of a json api, answers every path with its own name
+    and the server version. Paths under /etag and /modified send validators
+    and answer 304 to conditional requests while the version is unchanged,
+    /status/<code> answers with that status, /rpc with a json rpc error
+    and /sleep answers after 0.5s
+    """
+
+    def do_GET(self):
+        version = self.server.version
+        etag = f'"v{version}"'
+        last_modified = f"Mon, 0{version} Jun 2020 00:00:00 GMT"
+        headers = {}
+        if self.path.startswith("/status/"):
+            return self.reply(b"", int(self.path.split("/")[2]))
+        if self.path == "/rpc":
+            error = {"code": -32601, "message": "method not found"}
+            return self.reply({"result": None, "error": error}, 500)
+        if self.path == "/sleep":
+            time.sleep(0.5)
+        if self.path.startswith("/etag"):
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                return self.reply(b"", 304, headers)
+        if self.path.startswith("/modified"):
+            headers["Last-Modified"] = last_modified
+            if self.headers.get("If-Modified-Since") == last_modified:
+                return self.reply(b"", 304, headers)
+        self.reply({"path": self.path, "version": version}, headers=headers)
+
+
+class TestHttpClient(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(StandInApi, version=1)
+        self.addCleanup(self.server.close)
+        self.base_url = self.server.url
+
+    def test_keep_alive(self):
+        client = HttpClient(self.base_url)
+        for i in range(5):
+            data = client.fetch(f"/pools/{i}")
+            self.assertEqual(data, {"path": f"/pools/{i}", "version": 1})
+        self.assertEqual(client.get_connection_stats(), {"opened": 1, "reused": 4})
+
+        client = HttpClient(self.base_url, keep_alive=False)
+        for i in range(5):
+            client.fetch("/pools")
+        self.assertEqual(client.get_connection_stats(), {"opened": 5, "reused": 0})
+
+    def test_retry(self):
+        policy = RetryPolicy(retries=3, backoff_factor=0, failure_threshold=100)
+        client = HttpClient(self.base_url, policy=policy)
+        with self.assertRaises(RetryError):
+            client.fetch("/status/502")
+        self.assertEqual(client.fetch("/pools")["path"], "/pools")
+        self.assertEqual(
+            client.get_retry_stats(), {"retries": 3, "trips": 0, "rejected": 0}
+        )
+
+        # retries stop at the deadline
+        policy = RetryPolicy(
+            retries=1000, backoff_factor=0.05, backoff_max=0.05, deadline=0.3
+        )
+        client = HttpClient(self.base_url, policy=policy)
+        start = time.monotonic()
+        with self.assertRaises(RetryError):
+            client.fetch("/status/502")
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertGreater(policy.retried, 0)
+        self.assertLess(policy.retried, 1000)
+
+        # attempts are bounded by the timeout
+        client = HttpClient(self.base_url, policy=RetryPolicy(retries=0, timeout=0.1))
+        with self.assertRaises(RequestException):
+            client.fetch("/sleep")
+
+    def test_circuit_breaker(self):
+        policy = RetryPolicy(retries=0, failure_threshold=2, reset_timeout=0.2)
+        client = HttpClient(self.base_url, policy=policy)
+        for i in range(2):
+            with self.assertRaises(RetryError):
+                client.fetch("/status/500")
+        with self.assertRaises(CircuitOpenError):
+            client.fetch("/pools")
+        self.assertEqual(
+            client.get_retry_stats(), {"retries": 0, "trips": 1, "rejected": 1}
+        )
+
+        # half open, one more failure trips it again
+        time.sleep(0.2)
+        with self.assertRaises(RetryError):
+            client.fetch("/status/500")
+        with self.assertRaises(CircuitOpenError):
+            client.fetch("/pools")
+        self.assertEqual(policy.trips, 2)
+
+        # a success closes it
+        time.sleep(0.2)
+        self.assertEqual(client.fetch("/pools")["path"], "/pools")
+        with self.assertRaises(RetryError):
+            client.fetch("/status/500")
+        self.assertEqual(client.fetch("/pools")["path"], "/pools")
+        self.assertEqual(
+            client.get_retry_stats(), {"retries": 0, "trips": 2, "rejected": 2}
+        )
+
+    def test_rpc_error(self):
+        policy = RetryPolicy(retries=3, backoff_factor=0, failure_threshold=1)
+        client = HttpClient(self.base_url, policy=policy)
+        for i in range(2):
+            with self.assertRaisesRegex(RetryError, "method not found"):
+                client.fetch("/rpc")
+        self.assertEqual(client.fetch("/pools")["path"], "/pools")
+        self.assertEqual(
+            client.get_retry_stats(), {"retries": 0, "trips": 0, "rejected": 0}
+        )
+
+    def test_shared_policy(self):
+        client = HttpClient(self.base_url)
+        self.assertIs(HttpClient(self.base_url + "/v1").policy, client.policy)
+        self.assertIs(get_policy(self.base_url), client.policy)
+        other = self.base_url.replace("127.0.0.1", "localhost")
+        self.assertIsNot(get_policy(other), client.policy)
+
+        # retries counted from concurrent requests
+        policy = RetryPolicy(retries=2, backoff_factor=0, failure_threshold=100)
+        client = HttpClient(self.base_url, policy=policy, pool_size=20)
+        errors = []
+
+        def get():
+            try:
+                client.session.get(client.get_url("/status/502"))
+            except RetryError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=get) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 20)
+        self.assertEqual(policy.retried, 40)
+
+    def test_conditional(self):
+        client = HttpClient(self.base_url)
+        for path in ["/etag/pools", "/modified/pools"]:
+            data = client.fetch(path)
+            self.assertEqual(data, {"path": path, "version": 1})
+            # callers may modify their result, not modified gets don't see it
+            data["version"] = "changed"
+            again = client.fetch(path)
+            self.assertEqual(again, {"path": path, "version": 1})
+            self.assertIsNot(again, data)
+        self.assertEqual(client.not_modified, 2)
+
+        # read only callers share the body parsed once
+        shared = client.fetch("/etag/pools", copy=False)
+        self.assertIs(client.fetch("/etag/pools", copy=False), shared)
+        self.assertEqual(client.fetch("/etag/pools"), shared)
+        self.assertEqual(client.not_modified, 5)
+
+        # a changed resource is fetched again
+        self.server.version = 2
+        self.assertEqual(client.fetch("/etag/pools")["version"], 2)
+        self.assertEqual(client.fetch("/modified/pools")["version"], 2)
+        self.assertEqual(client.fetch("/etag/pools")["version"], 2)
+        self.assertEqual(client.not_modified, 6)
+
+        # query args are part of the cached url
+        data = client.fetch("/etag/pools", {"asset": "BNB.BNB"})
+        self.assertEqual(data, {"path": "/etag/pools?asset=BNB.BNB", "version": 2})
+        self.assertEqual(client.not_modified, 6)
+
+        client = HttpClient(self.base_url, conditional=False)
+        client.fetch("/etag/pools")
+        client.fetch("/etag/pools")
+        self.assertEqual(client.not_modified, 0)
+
+    def test_coalesced_copies(self):
+        client = HttpClient(self.base_url)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(client.fetch("/sleep")))
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(client.flights.calls, 1)
+        self.assertEqual(results, [{"path": "/sleep", "version": 1}] * 3)
+        self.assertEqual(len({id(result) for result in results}), 3)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_do(self):
+        release = threading.Event()
+        calls = []
+
+        def get(path):
+            calls.append(path)
+            release.wait()
+            if path == "/fail":
+                raise Exception("failed")
+            return {"path": path}
+
+        flights = SingleFlight()
+        results = []
+        errors = []
+
+        def fetch(path):
+            try:
+                results.append(flights.do(path, get, path))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=fetch, args=(path,))
+            for path in ["/pools"] * 5 + ["/fail"] * 3
+        ]
+        for thread in threads:
+            thread.start()
+        while flights.shared < 6:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, ["/pools", "/fail"])
+        self.assertEqual(results, [{"path": "/pools"}] * 5)
+        self.assertIs(results[0], results[4])
+        self.assertEqual(len(errors), 3)
+        self.assertEqual((flights.calls, flights.shared), (2, 6))
+
+        # finished calls are not shared without a window
+        flights.do("/pools", get, "/pools")
+        self.assertEqual(len(calls), 3)
+
+    def test_window(self):
+        calls = []
+        flights = SingleFlight(window=60)
+        for i in range(3):
+            self.assertEqual(flights.do("/pools", calls.append, i), None)
+        self.assertEqual(calls, [0])
+        self.assertEqual((flights.calls, flights.shared), (1, 2))
+        flights.window = 0
+        flights.do("/pools", calls.append, 3)
+        self.assertEqual(calls, [0, 3])
+
+
+class TestAsyncHttpClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+
+        async def flaky(request):
+            self.calls += 1
+            if self.calls < 3:
+                return web.Response(status=502)
+            return web.json_response({"calls": self.calls, **request.query})
+
+        async def slow(request):
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            await asyncio.sleep(0.05)
+            self.running -= 1
+            return web.json_response({"id": request.match_info["id"]})
+
+        async def echo(request):
+            return web.Response(text=await request.text())
+
+        app = web.Application()
+        app.router.add_get("/flaky", flaky)
+        app.router.add_get("/slow/{id}", slow)
+        app.router.add_post("/echo", echo)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        base_url = f"http://{self.server.host}:{self.server.port}"
+        self.client = AsyncHttpClient(base_url, limit=50, backoff_factor=0)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.server.close()
+
+    async def test_fetch(self):
+        data = await self.client.fetch("/flaky", {"asset": "BNB.BNB"})
+        self.assertEqual(data, {"calls": 3, "asset": "BNB.BNB"})
+
+        self.client.retries = 0
+        self.calls = 0
+        with self.assertRaises(Exception):
+            await self.client.fetch("/flaky")
+
+    async def test_post(self):
+        data = await self.client.post("/echo", {"amount": 1, "price": 0.1})
+        self.assertEqual(data, {"amount": 1, "price": Decimal("0.1")})
+
+    async def test_concurrent(self):
+        results = await asyncio.gather(
+            *[self.client.fetch(f"/slow/{i}") for i in range(200)]
+        )
+        self.assertEqual(results, [{"id": str(i)} for i in range(200)])
+        self.assertGreater(self.max_running, 1)
+        self.assertLessEqual(self.max_running, 50)
+
+        # identical gets share one request
+        self.max_running = 0
+        fetches = [self.client.fetch("/slow/1") for i in range(50)]
+        results = await asyncio.gather(*fetches)
+        self.assertEqual(results, [{"id": "1"}] * 50)
+        self.assertEqual(self.max_running, 1)
+        self.assertEqual(self.client.flights.shared, 49)
+
+    async def test_coalesced_copies(self):
+        fetches = [self.client.fetch("/slow/1") for i in range(3)]
+        copies = await asyncio.gather(*fetches)
+        copies[0]["id"] = "changed"
+        self.assertEqual(copies[1:], [{"id": "1"}] * 2)
+        self.assertIsNot(copies[1], copies[2])
+
+        fetches = [self.client.fetch("/slow/2", copy=False) for i in range(3)]
+        first, *others = await asyncio.gather(*fetches)
+        self.assertEqual(first, {"id": "2"})
+        for other in others:
+            self.assertIs(other, first)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,10 +1,26 @@
+import base64
+import json
+import random
+import threading
+import time
 import unittest
+import numpy as np
 
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from thorchain.midgard import AsyncMidgardClient
 from thorchain.thorchain import (
+    AsyncThorchainClient,
+    BlockCache,
     ThorchainClient,
     ThorchainState,
     Pool,
     Event,
+    EventBuffer,
+    EventReconciler,
+    FramePipeline,
+    SUBSCRIBE_BLOCK,
+    SUBSCRIBE_TX,
 )
 from chains.binance import Binance
 
@@ -53,7 +69,7 @@ class TestThorchainState(unittest.TestCase):
         self.assertEqual(events, expected_events)
 
         # do a regular swap
-        thorchain.pools = [Pool("BNB.BNB", 50 * 100000000, 50 * 100000000)]
+        thorchain.set_pool(Pool("BNB.BNB", 50 * 100000000, 50 * 100000000))
         outbound = thorchain.handle(txn)
         outbound = thorchain.handle_fee(txn, outbound)
         self.assertEqual(len(outbound), 1)
@@ -123,7 +139,7 @@ class TestThorchainState(unittest.TestCase):
         # outbound = thorchain.handle_fee(txn, outbound)
         self.assertEqual(len(outbound), 1)
         self.assertEqual(outbound[0].memo, "REFUND:TODO")
-        self.assertEqual(thorchain.pools[0].rune_balance, 58 * 100000000)
+        self.assertEqual(thorchain.pools["BNB.BNB"].rune_balance, 58 * 100000000)
 
         # check refund event generated for swap with zero return
         # check refund event generated for swap with two coins
@@ -144,7 +160,7 @@ class TestThorchainState(unittest.TestCase):
         outbound = thorchain.handle(txn)
         outbound = thorchain.handle_fee(txn, outbound)
         self.assertEqual(len(outbound), 0)
-        self.assertEqual(thorchain.pools[0].rune_balance, 58 * 100000000)
+        self.assertEqual(thorchain.pools["BNB.BNB"].rune_balance, 58 * 100000000)
 
         # check refund event generated for swap with zero return
         expected_events += [
@@ -175,7 +191,7 @@ class TestThorchainState(unittest.TestCase):
         self.assertEqual(len(outbound), 1)
         self.assertEqual(outbound[0].memo, "REFUND:TODO")
         self.assertEqual(outbound[0].coins, [Coin(RUNE, 400000000)])
-        self.assertEqual(thorchain.pools[0].rune_balance, 58 * 100000000)
+        self.assertEqual(thorchain.pools["BNB.BNB"].rune_balance, 58 * 100000000)
 
         # check refund event generated for swap with limit
         reason = "emit asset 325254953 less than price limit 999999999999999999999"
@@ -259,7 +275,7 @@ class TestThorchainState(unittest.TestCase):
         # do a double swap
         txn.coins = [Coin("BNB.BNB", 1000000000)]
         txn.memo = "SWAP:BNB.LOK-3C0"
-        thorchain.pools.append(Pool("BNB.LOK-3C0", 30 * 100000000, 30 * 100000000))
+        thorchain.set_pool(Pool("BNB.LOK-3C0", 30 * 100000000, 30 * 100000000))
         outbound = thorchain.handle(txn)
         outbound = thorchain.handle_fee(txn, outbound)
         self.assertEqual(len(outbound), 1)
@@ -966,6 +982,71 @@ class TestThorchainState(unittest.TestCase):
         )
         self.assertEqual(stake_units, 34500000000)
 
+    def test_quote_swaps(self):
+        thorchain = ThorchainState()
+        thorchain.set_pool(Pool("BNB.BNB", 94382620747, 301902605))
+        thorchain.set_pool(Pool("BNB.LOK-3C0", 50 * 100000000, 30 * 100000000))
+        amounts = [0, 1, 100001000, 1000000000, 10 ** 15]
+
+        # single swaps match the scalar swap
+        for source, target in [(RUNE, "BNB.BNB"), ("BNB.BNB", RUNE)]:
+            legs = thorchain.quote_swaps(amounts, source, target)
+            self.assertEqual(len(legs), 1)
+            for i, amount in enumerate(amounts):
+                emit, fee, fee_in_rune, slip, _ = thorchain.swap(
+                    Coin(source, amount), target
+                )
+                quote = [leg[i] for leg in legs[0]]
+                self.assertEqual(quote, [emit.amount, fee, fee_in_rune, slip])
+
+        # double swaps go through rune
+        legs = thorchain.quote_swaps(amounts, "BNB.BNB", "BNB.LOK-3C0")
+        self.assertEqual(len(legs), 2)
+        for i, amount in enumerate(amounts):
+            emit, fee, fee_in_rune, slip, _ = thorchain.swap(
+                Coin("BNB.BNB", amount), RUNE
+            )
+            quote = [leg[i] for leg in legs[0]]
+            self.assertEqual(quote, [emit.amount, fee, fee_in_rune, slip])
+            emit, fee, fee_in_rune, slip, _ = thorchain.swap(
+                Coin(RUNE, emit.amount), "BNB.LOK-3C0"
+            )
+            quote = [leg[i] for leg in legs[1]]
+            self.assertEqual(quote, [emit.amount, fee, fee_in_rune, slip])
+
+        # numpy integers are quoted like python ones
+        quotes = thorchain.quote_swaps(amounts, "BNB.BNB", "BNB.LOK-3C0")
+        np_amounts = list(np.array(amounts, dtype=np.int64))
+        np_quotes = thorchain.quote_swaps(np_amounts, "BNB.BNB", "BNB.LOK-3C0")
+        for leg, np_leg in zip(quotes, np_quotes):
+            for values, np_values in zip(leg, np_leg):
+                self.assertEqual(list(np_values), list(values))
+
+        # quoting does not change the pools
+        self.assertEqual(thorchain.get_pool("BNB.BNB").rune_balance, 94382620747)
+        self.assertEqual(thorchain.events, [])
+
+    def test_stakers(self):
+        pool = Pool("BNB.BNB")
+        pool.stake("STAKER-2", 100, 100, pool.asset, "TXID2")
+        pool.stake("STAKER-1", 100, 100, pool.asset, "TXID1")
+        pool.stake("STAKER-2", 100, 100, pool.asset, "TXID3")
+        self.assertEqual(pool.get_staker("STAKER-1").units, 100)
+        self.assertEqual(pool.get_staker("STAKER-2").units, 200)
+        self.assertEqual(pool.get_staker("STAKER-3").is_zero(), True)
+        self.assertEqual(list(pool.stakers), ["STAKER-2", "STAKER-1"])
+
+        # stakers are exported as a list in insertion order
+        self.assertEqual(
+            pool.to_json(),
+            '{"asset": "BNB.BNB", "rune_balance": 300, "asset_balance": 300, '
+            '"total_units": 300, "stakers": ['
+            '{"address": "STAKER-2", "units": 200, "pending_rune": 0, '
+            '"pending_tx": null}, '
+            '{"address": "STAKER-1", "units": 100, "pending_rune": 0, '
+            '"pending_tx": null}], "status": "Enabled"}',
+        )
+
     def test_calc_liquidity_fee(self):
         thorchain = ThorchainState()
         fee = thorchain._calc_liquidity_fee(94382619747, 100001000, 301902607)
@@ -993,24 +1074,74 @@ class TestThorchainState(unittest.TestCase):
 
     def test_handle_rewards(self):
         thorchain = ThorchainState()
-        thorchain.pools.append(Pool("BNB.BNB", 94382620747, 301902605))
-        thorchain.pools.append(Pool("BNB.LOKI", 50000000000, 100))
+        thorchain.set_pool(Pool("BNB.BNB", 94382620747, 301902605))
+        thorchain.set_pool(Pool("BNB.LOKI", 50000000000, 100))
         thorchain.reserve = 40001517380253
 
         # test minus rune from pools and add to bond rewards (too much rewards to pools)
         thorchain.liquidity["BNB.BNB"] = 105668
         thorchain.handle_rewards()
-        self.assertEqual(thorchain.pools[0].rune_balance, 94382515079)
+        self.assertEqual(thorchain.pools["BNB.BNB"].rune_balance, 94382515079)
 
         # test no swaps this block (no rewards)
         thorchain.handle_rewards()
-        self.assertEqual(thorchain.pools[0].rune_balance, 94382515079)
+        self.assertEqual(thorchain.pools["BNB.BNB"].rune_balance, 94382515079)
 
         # test add rune to pools (not enough funds to pools)
         thorchain.liquidity["BNB.LOKI"] = 103
         thorchain.total_bonded = 5000000000000
         thorchain.handle_rewards()
-        self.assertEqual(thorchain.pools[1].rune_balance, 50000997031)
+        self.assertEqual(thorchain.pools["BNB.LOKI"].rune_balance, 50000997031)
+
+    def test_handle_rewards_layouts(self):
+        thorchain = ThorchainState()
+        for i in range(100):
+            thorchain.set_pool(Pool(f"BNB.TKN{i}", 50000000000, 50000000000))
+        thorchain.reserve = 40001517380253
+        layouts = len(Event._layouts)
+
+        # a rewards event over the same pools every block adds one layout
+        for block in range(10):
+            for i in range(100):
+                thorchain.liquidity[f"BNB.TKN{i}"] = 100000
+            thorchain.handle_rewards()
+        self.assertEqual(len(thorchain.events[-1].attributes), 101)
+        self.assertLessEqual(len(Event._layouts), layouts + 1)
+
+        # changing pool sets don't grow the layouts past the limit
+        max_layouts = Event.max_layouts
+        Event.max_layouts = len(Event._layouts) + 5
+        try:
+            for block in range(20):
+                for i in range(block + 1):
+                    thorchain.liquidity[f"BNB.TKN{i}"] = 100000
+                thorchain.handle_rewards()
+                self.assertIsNotNone(thorchain.events[-1].get(f"BNB.TKN{block}"))
+            self.assertEqual(len(Event._layouts), Event.max_layouts)
+        finally:
+            Event.max_layouts = max_layouts
+
+    def test_set_pool(self):
+        thorchain = ThorchainState()
+        thorchain.set_pool(Pool("BNB.BNB", 50 * 100000000, 50 * 100000000))
+        thorchain.set_pool(Pool("BNB.LOK-3C0", 30 * 100000000, 30 * 100000000))
+        thorchain.set_pool(Pool("BTC.BTC", 20 * 100000000, 20 * 100000000))
+        self.assertEqual(thorchain.get_pool("BNB.LOK-3C0").rune_balance, 3000000000)
+        self.assertEqual(thorchain.get_pool("ETH.ETH").is_zero(), True)
+        self.assertEqual(len(thorchain.pools), 3)
+        self.assertEqual(thorchain.events, [])
+
+        # replacing an enabled pool with an empty one bootstraps it
+        thorchain.set_pool(Pool("BNB.LOK-3C0", 0, 30 * 100000000))
+        self.assertEqual(thorchain.get_pool("BNB.LOK-3C0").status, "Bootstrap")
+        expected_events = [
+            Event("pool", [{"pool": "BNB.LOK-3C0"}, {"pool_status": "Bootstrap"}]),
+        ]
+        self.assertEqual(thorchain.events, expected_events)
+
+        # pools keep their insertion order
+        assets = [pool.asset for pool in thorchain.pools.values()]
+        self.assertEqual(assets, ["BNB.BNB", "BNB.LOK-3C0", "BTC.BTC"])
 
 
 class TestEvent(unittest.TestCase):
@@ -1034,6 +1165,38 @@ class TestEvent(unittest.TestCase):
         random = swap.get("random")
         self.assertEqual(random, None)
 
+    def test_attributes(self):
+        attributes = [{"pool": "BNB.BNB"}, {"stake_units": 100}]
+        stake = Event("stake", attributes, 3, "tx")
+        self.assertEqual(
+            stake.attributes, [{"pool": "BNB.BNB"}, {"stake_units": "100"}]
+        )
+        self.assertEqual(attributes[1], {"stake_units": 100})
+        stake.add_attribute({"BNB_txid": "FAAFF"})
+        self.assertEqual(stake.get("BNB_txid"), "FAAFF")
+        self.assertEqual(stake.get("stake_units"), "100")
+        self.assertEqual(
+            stake.__dict__,
+            {
+                "type": "stake",
+                "attributes": [
+                    {"pool": "BNB.BNB"},
+                    {"stake_units": "100"},
+                    {"BNB_txid": "FAAFF"},
+                ],
+                "block_height": 3,
+                "category": "tx",
+            },
+        )
+        # events built with the same keys share their key index,
+        # appended attributes are indexed by the event only
+        other = Event("stake", [{"pool": "BNB.LOK-3C0"}, {"stake_units": 5}])
+        self.assertIs(other._index, Event("stake", attributes)._index)
+        layouts = len(Event._layouts)
+        other.add_attribute({"BNB_txid": "BAAFF"})
+        self.assertEqual(other.get("BNB_txid"), "BAAFF")
+        self.assertEqual(len(Event._layouts), layouts)
+
     def test_eq(self):
         outbound_sim = Event(
             "outbound",
@@ -1111,6 +1274,29 @@ class TestEvent(unittest.TestCase):
         )
         self.assertEqual(swap_sim, swap)
 
+    def test_canonical_key(self):
+        outbound = Event(
+            "outbound",
+            [{"in_tx_id": "faaff"}, {"id": "67672"}, {"memo": "refund:faaff"}],
+        )
+        self.assertEqual(
+            outbound.canonical_key,
+            ("outbound", (("in_tx_id", "FAAFF"), ("memo", "REFUND:FAAFF"))),
+        )
+        # comparing events does not change their attributes
+        self.assertEqual(hash(outbound), hash(outbound))
+        self.assertEqual(outbound.get("memo"), "refund:faaff")
+        # adding attributes resets the key
+        outbound.add_attribute({"coin": "1 BNB.BNB"})
+        self.assertEqual(len(outbound.canonical_key[1]), 3)
+        other = Event(
+            "outbound",
+            [{"coin": "1 BNB.BNB"}, {"memo": "REFUND:FAAFF"}, {"in_tx_id": "FAAFF"}],
+        )
+        self.assertEqual(outbound, other)
+        self.assertEqual(hash(outbound), hash(other))
+        self.assertFalse(outbound < other or other < outbound)
+
     def test_sort_events(self):
         evt1 = Event("test", [{"id": 1}], 1, "block")
         evt2 = Event("test", [{"id": 2}], 1, "tx")
@@ -1181,5 +1367,306 @@ class TestEvent(unittest.TestCase):
         self.assertEqual(sorted(sim_events), sorted(events))
 
 
+class TestEventBuffer(unittest.TestCase):
+    def test_add(self):
+        evt1 = Event("test", [{"id": 1}], 1, "block")
+        evt2 = Event("test", [{"id": 2}], 1, "tx")
+        evt3 = Event("test", [{"id": 3}], 6, "block")
+        evt4 = Event("test", [{"id": 4}], 3, "tx")
+        evt5 = Event("test", [{"id": 5}], 3, "block")
+        evt6 = Event("test", [{"id": 6}], 2, "block")
+        evt7 = Event("test", [{"id": 7}], 3, "tx")
+        buffer = EventBuffer()
+        for evt in [evt1, evt2, evt3, evt4, evt5, evt6, evt7]:
+            buffer.add([evt], str(evt.block_height), evt.category)
+
+        expected_events = [evt2, evt1, evt6, evt4, evt7, evt5, evt3]
+        self.assertEqual(len(buffer), 7)
+        self.assertEqual(list(buffer), expected_events)
+        self.assertEqual(buffer.log, [evt1, evt2, evt3, evt4, evt5, evt6, evt7])
+        for start in range(-8, 9):
+            for stop in range(-8, 9):
+                self.assertEqual(
+                    buffer[start:stop], expected_events[start:stop], (start, stop)
+                )
+        self.assertEqual(buffer[::2], expected_events[::2])
+        self.assertEqual(buffer[4], evt7)
+        self.assertEqual(buffer[-1], evt3)
+        with self.assertRaises(IndexError):
+            buffer[7]
+
+        buffer.clear()
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer[:], [])
+        self.assertEqual(buffer.log, [])
+
+    def test_wait(self):
+        buffer = EventBuffer()
+        buffer.add([Event("swap", [{"in_tx_id": "TX0"}])], 1, "tx")
+
+        def add_later():
+            for i in range(1, 4):
+                time.sleep(0.01)
+                events = [Event("swap", [{"in_tx_id": f"TX{i}"}]), Event("fee", [])]
+                buffer.add(events, i + 1, "block")
+
+        thread = threading.Thread(target=add_later)
+        thread.start()
+        self.assertTrue(buffer.wait_for_count(2, "swap", timeout=5))
+        evt = buffer.wait_for_event("swap", timeout=5, in_tx_id="TX3")
+        self.assertEqual(evt, Event("swap", [{"in_tx_id": "TX3"}]))
+        self.assertTrue(buffer.wait_for_height(4, timeout=5))
+        thread.join()
+
+        self.assertEqual(buffer.count("swap"), 4)
+        self.assertEqual(buffer.count("fee"), 3)
+        self.assertEqual(buffer.count(), 7)
+        self.assertEqual(buffer.height, 4)
+        self.assertTrue(buffer.wait_for_count(7, timeout=0))
+        self.assertFalse(buffer.wait_for_count(8, timeout=0.01))
+        self.assertFalse(buffer.wait_for_height(5, timeout=0.01))
+        self.assertIsNone(buffer.wait_for_event("swap", timeout=0.01, in_tx_id="TX4"))
+        self.assertIsNone(
+            buffer.wait_for_event("swap", timeout=0.01, start=1, in_tx_id="TX0")
+        )
+
+
+class TestBlockCache(unittest.TestCase):
+    def test_get(self):
+        paths = []
+
+        def fetch(path, copy=True):
+            paths.append(path)
+            return {"path": path, "fetch": len(paths)}
+
+        client = ThorchainClient.__new__(ThorchainClient)
+        client.fetch = fetch
+        client.cache = None
+        client.get_pools()
+        client.get_pools()
+        self.assertEqual(len(paths), 2)
+        self.assertEqual(client.get_cache_stats(), {"hits": 0, "misses": 0})
+
+        paths.clear()
+        client.events = EventBuffer()
+        client.cache = BlockCache()
+        client.events.add([], 1, "block")
+        pools = client.get_pools()
+        self.assertIs(client.get_pools(), pools)
+        client.get_vault_data()
+        client.get_vault_data()
+        self.assertEqual(paths, ["/thorchain/pools", "/thorchain/vault"])
+
+        # a new block invalidates every entry
+        client.events.add([], 2, "block")
+        self.assertEqual(client.get_pools()["fetch"], 3)
+        self.assertEqual(client.get_pools()["fetch"], 3)
+        self.assertEqual(client.get_cache_stats(), {"hits": 3, "misses": 3})
+
+        client.cache.clear()
+        self.assertEqual(client.get_pools()["fetch"], 4)
+
+
+class TestEventReconciler(unittest.TestCase):
+    def test_sync(self):
+        def event(i, id="TODO"):
+            return Event("outbound", [{"in_tx_id": f"TX{i}"}, {"id": id}])
+
+        reconciler = EventReconciler()
+        events = [event(1, "A1"), event(2, "A2")]
+        sim_events = [event(2)]
+        reconciler.sync(events, sim_events)
+        self.assertFalse(reconciler.is_matched())
+        self.assertEqual(reconciler.unmatched(), ([events[0]], []))
+
+        # events arrive later in any order
+        events += [event(3, "A3"), event(3, "A4")]
+        sim_events += [event(1), event(3)]
+        reconciler.sync(events, sim_events)
+        self.assertEqual(reconciler.unmatched(), ([event(3, "A4")], []))
+        sim_events.append(event(3))
+        reconciler.sync(events, sim_events)
+        self.assertTrue(reconciler.is_matched())
+        self.assertEqual(reconciler.real_cursor, 4)
+        self.assertEqual(reconciler.sim_cursor, 4)
+
+        # one missing event doesn't shift later events into mismatches
+        events += [event(4, "A5"), event(5, "A6"), event(6, "A7")]
+        sim_events += [event(4), event(6)]
+        reconciler.sync(events, sim_events)
+        self.assertEqual(reconciler.unmatched(), ([event(5)], []))
+        sim_events += [event(7)]
+        reconciler.sync(events, sim_events)
+        self.assertEqual(reconciler.unmatched(), ([event(5)], [event(7)]))
+
+
+class TestFramePipeline(unittest.TestCase):
+    def test_order(self):
+        def decode(frame):
+            time.sleep(random.random() / 1000)
+            if frame == "bad":
+                raise Exception("bad frame")
+            return frame
+
+        committed = []
+        pipeline = FramePipeline(decode, committed.append, workers=4, max_frames=8)
+        frames = [f"frame{i}" for i in range(100)]
+        frames[42] = "bad"
+        for frame in frames:
+            pipeline.put(frame)
+        pipeline.join()
+        self.assertEqual(committed, frames[:42] + frames[43:])
+        self.assertEqual(
+            pipeline.get_stats(),
+            {"received": 100, "decoded": 99, "dropped": 1, "depth": 0},
+        )
+
+    def test_backpressure(self):
+        release = threading.Event()
+
+        def decode(frame):
+            release.wait()
+            return frame
+
+        committed = []
+        pipeline = FramePipeline(
+            decode, committed.append, workers=1, max_frames=2, timeout=0.01
+        )
+        pipeline.put(0)
+        while pipeline.depth:
+            time.sleep(0.001)
+        for i in range(1, 5):
+            pipeline.put(i)
+        # one frame held by the worker, two queued, the rest dropped
+        self.assertEqual(pipeline.received, 5)
+        self.assertEqual(pipeline.dropped, 2)
+        self.assertEqual(pipeline.depth, 2)
+        release.set()
+        pipeline.join()
+        self.assertEqual(committed, [0, 1, 2])
+        self.assertEqual(pipeline.decoded, 3)
+        self.assertEqual(pipeline.depth, 0)
+
+    def test_decode_frame(self):
+        def attr(key, value):
+            return {
+                "key": base64.b64encode(key.encode()).decode(),
+                "value": base64.b64encode(value.encode()).decode(),
+            }
+
+        frame = {
+            "result": {
+                "data": {
+                    "type": "tendermint/event/Tx",
+                    "value": {
+                        "TxResult": {
+                            "height": "12",
+                            "result": {
+                                "events": [
+                                    {"type": "message", "attributes": []},
+                                    {
+                                        "type": "stake",
+                                        "attributes": [attr("pool", "BNB.BNB")],
+                                    },
+                                ]
+                            },
+                        }
+                    },
+                }
+            }
+        }
+        client = ThorchainClient.__new__(ThorchainClient)
+        self.assertEqual(client.decode_frame(json.dumps({"result": {}})), [])
+        batches = client.decode_frame(json.dumps(frame))
+        self.assertEqual(
+            batches, [([Event("stake", [{"pool": "BNB.BNB"}])], "12", "tx")]
+        )
+        self.assertEqual(batches[0][0][0].block_height, "12")
+
+        # blocks without events still report their height
+        value = {"result_end_block": {}, "block": {"header": {"height": "13"}}}
+        data = {"type": "tendermint/event/NewBlock", "value": value}
+        frame = {"result": {"data": data}}
+        self.assertEqual(client.decode_frame(json.dumps(frame)), [([], "13", "block")])
+
+
+class TestAsyncThorchainClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        def attr(key, value):
+            return {
+                "key": base64.b64encode(key.encode()).decode(),
+                "value": base64.b64encode(value.encode()).decode(),
+            }
+
+        def block(height, events):
+            value = {
+                "result_end_block": {"events": events},
+                "block": {"header": {"height": str(height)}},
+            }
+            return {"result": {"data": {"type": "NewBlock", "value": value}}}
+
+        async def websocket(request):
+            ws = web.WebSocketResponse()
+            await ws.prepare(request)
+            subscriptions = [await ws.receive_json(), await ws.receive_json()]
+            self.assertEqual(subscriptions, [SUBSCRIBE_BLOCK, SUBSCRIBE_TX])
+            await ws.send_json({"result": {}})
+            await ws.send_json(block(1, []))
+            await ws.send_str("not json")
+            for height in range(2, 4):
+                gas = {"type": "gas", "attributes": [attr("asset", "BNB.BNB")]}
+                await ws.send_json(block(height, [gas]))
+            await ws.close()
+            return ws
+
+        routes = {
+            "/thorchain/lastblock": {"thorchain": "12"},
+            "/thorchain/pool_addresses": {
+                "current": [
+                    {"chain": "BNB", "address": "tbnb1", "pub_key": "PUB"},
+                    {"chain": "BTC", "address": "bcrt1", "pub_key": "PUB"},
+                ]
+            },
+            "/thorchain/pools": [{"asset": "BNB.BNB"}],
+            "/v1/pools/detail": [{"asset": "BNB.BNB"}],
+        }
+
+        async def handle(request):
+            if request.path == "/v1/pools/detail":
+                self.assertEqual(request.query["asset"], "BNB.BNB,BTC.BTC")
+            return web.json_response(routes[request.path])
+
+        app = web.Application()
+        app.router.add_get("/websocket", websocket)
+        for path in routes:
+            app.router.add_get(path, handle)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.base_url = f"http://{self.server.host}:{self.server.port}"
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def test_get(self):
+        async with AsyncThorchainClient(self.base_url) as client:
+            await client.wait_for_node()
+            self.assertEqual(await client.get_block_height(), 12)
+            self.assertEqual(await client.get_vault_address("BTC"), "bcrt1")
+            self.assertEqual(await client.get_vault_pubkey(), "PUB")
+            self.assertEqual(await client.get_pools(), [{"asset": "BNB.BNB"}])
+
+        async with AsyncMidgardClient(self.base_url) as client:
+            pools = await client.get_pool(["BNB.BNB", "BTC.BTC"])
+            self.assertEqual(pools, [{"asset": "BNB.BNB"}])
+
+    async def test_stream_events(self):
+        async with AsyncThorchainClient(self.base_url) as client:
+            url = f"ws://{self.server.host}:{self.server.port}/websocket"
+            events = [evt async for evt in client.stream_events(url)]
+        self.assertEqual(events, [Event("gas", [{"asset": "BNB.BNB"}])] * 2)
+        self.assertEqual([e.block_height for e in events], ["2", "3"])
+        self.assertEqual([e.category for e in events], ["block", "block"])
+
+
 if __name__ == "__main__":
     unittest.main()
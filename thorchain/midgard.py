@@ -1,4 +1,4 @@
-from utils.common import HttpClient
+from utils.common import HttpClient, AsyncHttpClient
 
 
 class MidgardClient(HttpClient):
@@ -16,3 +16,20 @@ class MidgardClient(HttpClient):
 
         assets = ",".join(assets)
         return self.fetch(f"/v1/pools/detail?asset={assets}")
+
+
+class AsyncMidgardClient(AsyncHttpClient):
+    """
+    An asyncio client implementation to midgard API
+    """
+
+    async def get_pool(self, assets):
+        """Get pool data for specific set of assets.
+
+        :param str asset: Assets name
+        :returns: Pool data
+
+        """
+
+        assets = ",".join(assets)
+        return await self.fetch(f"/v1/pools/detail?asset={assets}")
@@ -1,19 +1,31 @@
 import base64
+import bisect
 import logging
+import sys
+import queue
 import threading
+import aiohttp
 import websocket
 import json
-from copy import deepcopy
+import numpy as np
 
 from utils.common import (
     Transaction,
     Coin,
     Asset,
-    get_share,
     HttpClient,
+    AsyncHttpClient,
     Jsonable,
     get_rune_asset,
 )
+from utils.amm import (
+    get_share,
+    div_round_array,
+    calc_asset_emission,
+    calc_liquidity_fee,
+    calc_trade_slip,
+    calc_stake_units,
+)
 
 from chains.aliases import get_alias, get_alias_address, get_aliases
 from chains.bitcoin import Bitcoin
@@ -40,10 +52,11 @@ class ThorchainClient(HttpClient):
     A client implementation to thorchain API
     """
 
-    def __init__(self, api_url, websocket_url=None):
+    def __init__(self, api_url, websocket_url=None, decoders=2, max_frames=1000):
         super().__init__(api_url)
 
         self.wait_for_node()
+        self.cache = None
 
         if websocket_url:
             self.ws = websocket.WebSocketApp(
@@ -52,7 +65,14 @@ class ThorchainClient(HttpClient):
                 on_error=self.ws_error,
                 on_message=self.ws_message,
             )
-            self.events = []
+            self.events = EventBuffer()
+            self.cache = BlockCache()
+            self.frames = FramePipeline(
+                self.decode_frame,
+                self.commit_frame,
+                workers=decoders,
+                max_frames=max_frames,
+            )
             threading.Thread(target=self.ws.run_forever, daemon=True).start()
 
     @retry(stop=stop_after_delay(30), wait=wait_fixed(1))
@@ -72,27 +92,39 @@ class ThorchainClient(HttpClient):
 
     def ws_message(self, msg):
         """
-        Websocket message handler
+        Websocket message handler, frames are only queued here
+        and decoded by the frame pipeline workers
         """
-        try:
-            msg = json.loads(msg)
-            logging.debug(f"websocket msg: {msg}")
-            if "data" not in msg["result"]:
-                return
-            event_category = msg["result"]["data"]["type"]
-            value = msg["result"]["data"]["value"]
-            if "NewBlock" in event_category:
-                if "events" not in value["result_end_block"]:
-                    return
-                events = value["result_end_block"]["events"]
-                block_height = value["block"]["header"]["height"]
-                self.process_events(events, block_height, "block")
-            if "Tx" in event_category:
-                events = value["TxResult"]["result"]["events"]
-                block_height = value["TxResult"]["height"]
-                self.process_events(events, block_height, "tx")
-        except Exception as e:
-            logging.error(f"Message: {msg} Exception: {e}")
+        self.frames.put(msg)
+
+    def decode_frame(self, msg):
+        """
+        Decode a websocket frame into a list of
+        (events, block height, category) batches
+        """
+        msg = json.loads(msg)
+        logging.debug(f"websocket msg: {msg}")
+        if "data" not in msg["result"]:
+            return []
+        batches = []
+        event_category = msg["result"]["data"]["type"]
+        value = msg["result"]["data"]["value"]
+        if "NewBlock" in event_category:
+            events = value["result_end_block"].get("events", [])
+            block_height = value["block"]["header"]["height"]
+            batches.append(self.process_events(events, block_height, "block"))
+        if "Tx" in event_category:
+            events = value["TxResult"]["result"]["events"]
+            block_height = value["TxResult"]["height"]
+            batches.append(self.process_events(events, block_height, "tx"))
+        return batches
+
+    def commit_frame(self, batches):
+        """
+        Add the decoded batches of a frame to the events buffer
+        """
+        for events, block_height, category in batches:
+            self.events.add(events, block_height, category)
 
     def process_events(self, events, block_height, category):
         new_events = []
@@ -102,9 +134,34 @@ class ThorchainClient(HttpClient):
             self.decode_event(event)
             evt = Event(event["type"], event["attributes"], block_height, category,)
             new_events.append(evt)
-        new_events += self.events
-        self.sort_events(new_events)
-        self.events = new_events
+        return new_events, block_height, category
+
+    def wait_for_events(self, count, event_type=None, timeout=None):
+        """
+        Wait until count events of a type (or in total) were received
+
+        :returns: (bool) False on timeout
+        """
+        return self.events.wait_for_count(count, event_type, timeout)
+
+    def wait_for_event(self, event_type, timeout=None, **attributes):
+        """
+        Wait for an event with the given attribute values,
+        e.g. wait_for_event("outbound", in_tx_id=txid)
+
+        :returns: the event or None on timeout
+        """
+        return self.events.wait_for_event(event_type, timeout, **attributes)
+
+    def wait_for_block(self, height=None, timeout=None):
+        """
+        Wait for a block height, or the next block if no height given
+
+        :returns: (bool) False on timeout
+        """
+        if height is None:
+            height = self.events.height + 1
+        return self.events.wait_for_height(height, timeout)
 
     @classmethod
     def sort_events(self, events):
@@ -129,6 +186,22 @@ class ThorchainClient(HttpClient):
         logging.error(error)
         raise Exception("thorchain websocket error")
 
+    def fetch_block(self, path):
+        """
+        Make a get request at most once per block height,
+        the height being the last one received on the websocket.
+        Without websocket every call makes the request.
+        The response is shared with the other readers, read only.
+        """
+        if self.cache is None:
+            return self.fetch(path, copy=False)
+        return self.cache.get(path, self.events.height, self.fetch, path, False)
+
+    def get_cache_stats(self):
+        if self.cache is None:
+            return {"hits": 0, "misses": 0}
+        return self.cache.get_stats()
+
     def get_block_height(self):
         """
         Get the current block height of mock binance
@@ -137,24 +210,397 @@ class ThorchainClient(HttpClient):
         return int(data["thorchain"])
 
     def get_vault_address(self, chain):
-        data = self.fetch("/thorchain/pool_addresses")
+        data = self.fetch_block("/thorchain/pool_addresses")
         for d in data["current"]:
             if chain == d["chain"]:
                 return d["address"]
         return "address not found"
 
     def get_vault_pubkey(self):
-        data = self.fetch("/thorchain/pool_addresses")
+        data = self.fetch_block("/thorchain/pool_addresses")
         return data["current"][0]["pub_key"]
 
     def get_vault_data(self):
-        return self.fetch("/thorchain/vault")
+        return self.fetch_block("/thorchain/vault")
 
     def get_asgard_vaults(self):
-        return self.fetch("/thorchain/vaults/asgard")
+        return self.fetch_block("/thorchain/vaults/asgard")
 
     def get_pools(self):
-        return self.fetch("/thorchain/pools")
+        return self.fetch_block("/thorchain/pools")
+
+
+class BlockCache:
+    """
+    Read through cache of thorchain api responses. Thorchain state only
+    changes with new blocks so an entry is served as long as the block
+    height it was fetched at is still the latest, the first read after a
+    new block fetches it again. Cached responses are shared, read only.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+    def get(self, key, height, load, *args):
+        """
+        Get the entry of key at height, calling load(*args) on a miss
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == height:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = load(*args)
+        self._entries[key] = (height, value)
+        return value
+
+    def clear(self):
+        self._entries = {}
+
+    def get_stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class AsyncThorchainClient(AsyncHttpClient):
+    """
+    An asyncio client implementation to thorchain API,
+    same methods as ThorchainClient as coroutines
+    """
+
+    decode_frame = ThorchainClient.decode_frame
+    process_events = ThorchainClient.process_events
+    decode_event = ThorchainClient.decode_event
+
+    @retry(stop=stop_after_delay(30), wait=wait_fixed(1))
+    async def wait_for_node(self):
+        current_height = await self.get_block_height()
+        if current_height < 1:
+            logging.warning("Thorchain starting, waiting")
+            raise Exception
+
+    async def stream_events(self, websocket_url):
+        """
+        Subscribe to the thorchain websocket and yield events as they arrive,
+        in the order of the websocket frames
+        """
+        async with self.session.ws_connect(websocket_url) as ws:
+            await ws.send_json(SUBSCRIBE_BLOCK)
+            await ws.send_json(SUBSCRIBE_TX)
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.ERROR:
+                    raise Exception("thorchain websocket error")
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                try:
+                    batches = self.decode_frame(msg.data)
+                except Exception as e:
+                    logging.error(f"Message: {msg.data} Exception: {e}")
+                    continue
+                for events, block_height, category in batches:
+                    for event in events:
+                        yield event
+
+    async def get_block_height(self):
+        """
+        Get the current block height of thorchain
+        """
+        data = await self.fetch("/thorchain/lastblock")
+        return int(data["thorchain"])
+
+    async def get_vault_address(self, chain):
+        data = await self.fetch("/thorchain/pool_addresses")
+        for d in data["current"]:
+            if chain == d["chain"]:
+                return d["address"]
+        return "address not found"
+
+    async def get_vault_pubkey(self):
+        data = await self.fetch("/thorchain/pool_addresses")
+        return data["current"][0]["pub_key"]
+
+    async def get_vault_data(self):
+        return await self.fetch("/thorchain/vault")
+
+    async def get_asgard_vaults(self):
+        return await self.fetch("/thorchain/vaults/asgard")
+
+    async def get_pools(self):
+        return await self.fetch("/thorchain/pools")
+
+
+class EventBuffer:
+    """
+    Thread safe buffer of thorchain events segmented by block height,
+    tx events are ordered before block events of the same height.
+
+    Indexing and slicing give events in that order and walk segments from
+    the closest end, so reading the latest events doesn't copy the buffer.
+    The log list keeps the same events in order of arrival, it is only
+    appended to so an index in it can be used as a cursor.
+
+    Callers can block until events arrive with the wait_for_* methods,
+    they are woken up on every add instead of polling the buffer.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._heights = []
+        self._segments = {}
+        self._count = 0
+        self._types = {}
+        self.height = 0
+        self.log = []
+
+    def add(self, events, block_height, category):
+        """
+        Add events received for a block height and category
+        """
+        height = int(block_height)
+        with self._lock:
+            segment = self._segments.get(height)
+            if segment is None:
+                segment = self._segments[height] = ([], [])
+                if not self._heights or height > self._heights[-1]:
+                    self._heights.append(height)
+                else:
+                    bisect.insort(self._heights, height)
+            segment[category == "block"].extend(events)
+            self._count += len(events)
+            for event in events:
+                self._types[event.type] = self._types.get(event.type, 0) + 1
+            self.height = max(self.height, height)
+            self.log.extend(events)
+            self._changed.notify_all()
+
+    def clear(self):
+        with self._lock:
+            self._heights = []
+            self._segments = {}
+            self._count = 0
+            self._types = {}
+            self.height = 0
+            self.log = []
+
+    def count(self, event_type=None):
+        """
+        Number of events of a type, or of all events
+        """
+        if event_type is None:
+            return self._count
+        return self._types.get(event_type, 0)
+
+    def wait(self, predicate, timeout=None):
+        """
+        Block until predicate returns a true value or timeout seconds pass.
+        The predicate is called with the buffer lock held on every add.
+
+        :returns: the last predicate value
+        """
+        with self._changed:
+            return self._changed.wait_for(predicate, timeout)
+
+    def wait_for_count(self, count, event_type=None, timeout=None):
+        """
+        Block until there are at least count events of a type (or in total)
+
+        :returns: (bool) False on timeout
+        """
+        return self.wait(lambda: self.count(event_type) >= count, timeout)
+
+    def wait_for_height(self, height, timeout=None):
+        """
+        Block until events of a block height were received
+
+        :returns: (bool) False on timeout
+        """
+        return self.wait(lambda: self.height >= height, timeout)
+
+    def wait_for_event(self, event_type, timeout=None, start=0, **attributes):
+        """
+        Block until an event of a type with the given attribute values
+        arrives, looking at the log from the start cursor
+
+        :returns: the event or None on timeout
+        """
+        cursor = start
+
+        def find():
+            nonlocal cursor
+            for i in range(cursor, len(self.log)):
+                event = self.log[i]
+                if event.type != event_type:
+                    continue
+                if all(event.get(k) == v for k, v in attributes.items()):
+                    return event
+            cursor = len(self.log)
+            return None
+
+        return self.wait(find, timeout)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        with self._lock:
+            if isinstance(index, slice):
+                start, stop, step = index.indices(self._count)
+                if step != 1:
+                    return self._slice(0, self._count)[index]
+                return self._slice(start, stop)
+            if index < 0:
+                index += self._count
+            if index < 0 or index >= self._count:
+                raise IndexError("event index out of range")
+            return self._slice(index, index + 1)[0]
+
+    def _lists(self, reverse=False):
+        """
+        Event lists of every segment in order
+        """
+        if reverse:
+            for height in reversed(self._heights):
+                tx_events, block_events = self._segments[height]
+                yield block_events
+                yield tx_events
+        else:
+            for height in self._heights:
+                tx_events, block_events = self._segments[height]
+                yield tx_events
+                yield block_events
+
+    def _slice(self, start, stop):
+        """
+        Events between start and stop, walking from the closest end
+        """
+        needed = stop - start
+        if needed <= 0:
+            return []
+
+        if self._count - start < stop:
+            chunks = []
+            skip = self._count - stop
+            for events in self._lists(reverse=True):
+                if skip >= len(events):
+                    skip -= len(events)
+                    continue
+                end = len(events) - skip
+                skip = 0
+                chunk = events[max(0, end - needed) : end]
+                chunks.append(chunk)
+                needed -= len(chunk)
+                if needed == 0:
+                    break
+            return [e for chunk in reversed(chunks) for e in chunk]
+
+        result = []
+        skip = start
+        for events in self._lists():
+            if skip >= len(events):
+                skip -= len(events)
+                continue
+            chunk = events[skip : skip + needed]
+            skip = 0
+            result.extend(chunk)
+            needed -= len(chunk)
+            if needed == 0:
+                break
+        return result
+
+
+class FramePipeline:
+    """
+    Decode websocket frames on a bounded pool of worker threads.
+
+    Frames are numbered on arrival and their decoded results are committed
+    in that order, whichever worker finishes first. The frame queue is
+    bounded: when it is full put blocks the receiving thread (or drops the
+    frame after timeout seconds if a timeout is set), so a slow decoder
+    pushes back on the socket instead of growing memory.
+    """
+
+    def __init__(self, decode, commit, workers=2, max_frames=1000, timeout=None):
+        self.decode = decode
+        self.commit = commit
+        self.timeout = timeout
+        self.received = 0
+        self.decoded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_frames)
+        self._lock = threading.Lock()
+        self._results = {}
+        self._next_put = 0
+        self._next_commit = 0
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def get_stats(self):
+        return {
+            "received": self.received,
+            "decoded": self.decoded,
+            "dropped": self.dropped,
+            "depth": self.depth,
+        }
+
+    def put(self, frame):
+        """
+        Queue a frame for decoding, called from the receiving thread only
+        """
+        self.received += 1
+        try:
+            self._queue.put((self._next_put, frame), timeout=self.timeout)
+        except queue.Full:
+            logging.warning("websocket frame queue full, dropping frame")
+            with self._lock:
+                self.dropped += 1
+            return
+        self._next_put += 1
+
+    def join(self):
+        """
+        Wait until every queued frame has been decoded and committed
+        """
+        self._queue.join()
+
+    def _work(self):
+        while True:
+            seq, frame = self._queue.get()
+            try:
+                result = self.decode(frame)
+            except Exception as e:
+                logging.error(f"Message: {frame} Exception: {e}")
+                result = None
+            self._done(seq, result)
+            self._queue.task_done()
+
+    def _done(self, seq, result):
+        """
+        Store a decoded result and commit every result now in order
+        """
+        with self._lock:
+            self._results[seq] = result
+            while self._next_commit in self._results:
+                result = self._results.pop(self._next_commit)
+                self._next_commit += 1
+                if result is None:
+                    self.dropped += 1
+                    continue
+                try:
+                    self.commit(result)
+                except Exception as e:
+                    logging.error(f"Commit: {result} Exception: {e}")
+                    self.dropped += 1
+                    continue
+                self.decoded += 1
 
 
 class ThorchainState:
@@ -165,7 +611,7 @@ class ThorchainState:
     rune_fee = 100000000
 
     def __init__(self):
-        self.pools = []
+        self.pools = {}
         self.events = []
         self.reserve = 0
         self.liquidity = {}
@@ -185,34 +631,29 @@ class ThorchainState:
         """
         Fetch a specific pool by asset
         """
-        for pool in self.pools:
-            if pool.asset == asset:
-                return pool
+        if asset in self.pools:
+            return self.pools[asset]
 
         return Pool(asset)
 
     def set_pool(self, pool):
         """
-        Set a pool
+        Set a pool, pools are keyed by asset and keep their insertion order
         """
-        for i, p in enumerate(self.pools):
-            if p.asset == pool.asset:
-                if (
-                    pool.asset_balance == 0 or pool.rune_balance == 0
-                ) and pool.status == "Enabled":
+        if pool.asset in self.pools:
+            if (
+                pool.asset_balance == 0 or pool.rune_balance == 0
+            ) and pool.status == "Enabled":
 
-                    pool.status = "Bootstrap"
+                pool.status = "Bootstrap"
 
-                    # Generate pool event with new status
-                    event = Event(
-                        "pool", [{"pool": pool.asset}, {"pool_status": pool.status}]
-                    )
-                    self.events.append(event)
-
-                self.pools[i] = pool
-                return
+                # Generate pool event with new status
+                event = Event(
+                    "pool", [{"pool": pool.asset}, {"pool_status": pool.status}]
+                )
+                self.events.append(event)
 
-        self.pools.append(pool)
+        self.pools[pool.asset] = pool
 
     def handle_gas(self, txns):
         """
@@ -352,7 +793,7 @@ class ThorchainState:
         # get the total staked
         # TODO: skip non-enabled pools
         total_staked = 0
-        for pool in self.pools:
+        for pool in self.pools.values():
             total_staked += pool.rune_balance
 
         if total_staked == 0:  # nothing staked, no rewards
@@ -362,9 +803,7 @@ class ThorchainState:
         # blocks in a year
         emission_curve = 6
         blocks_per_year = 6311390
-        block_rewards = int(
-            round(float(self.reserve) / emission_curve / blocks_per_year)
-        )
+        block_rewards = get_share(1, emission_curve * blocks_per_year, self.reserve)
 
         # total income made on the network
         system_income = block_rewards + self._total_liquidity()
@@ -378,10 +817,11 @@ class ThorchainState:
         # Zero payments to stakers when staked == bonded
         if total_staked < self.total_bonded:
             # (y + x) / (y - x)
-            factor = float(self.total_bonded + total_staked) / float(
-                self.total_bonded - total_staked
+            staker_split = get_share(
+                self.total_bonded - total_staked,
+                self.total_bonded + total_staked,
+                system_income,
             )
-            staker_split = int(round(system_income / factor))
 
         bond_reward = system_income - staker_split
 
@@ -401,8 +841,8 @@ class ThorchainState:
         self.reserve -= bond_reward + pool_reward
         self.bond_reward += bond_reward  # add to bond reward pool
 
-        # Generate rewards event
-        reward_event = Event("rewards", [{"bond_reward": bond_reward}])
+        # attributes of the rewards event
+        reward_attrs = [{"bond_reward": bond_reward}]
 
         if pool_reward > 0:
             # TODO: subtract any remaining gas, from the pool rewards
@@ -414,7 +854,7 @@ class ThorchainState:
                     self.set_pool(pool)
 
                     # Append pool reward to event
-                    reward_event.attributes.append({pool.asset: str(share)})
+                    reward_attrs.append({pool.asset: str(share)})
             else:
                 pass  # TODO: Pool Rewards are based on Depth Share
         else:
@@ -426,10 +866,10 @@ class ThorchainState:
                 self.set_pool(pool)
 
                 # Append pool reward to event
-                reward_event.attributes.append({pool.asset: str(-share)})
+                reward_attrs.append({pool.asset: str(-share)})
 
         # generate event REWARDS
-        self.events.append(reward_event)
+        self.events.append(Event("rewards", reward_attrs))
 
         # clear summed liquidity fees
         self.liquidity = {}
@@ -485,7 +925,7 @@ class ThorchainState:
         :returns: txs OUT
 
         """
-        tx = deepcopy(txn)  # copy of transaction
+        tx = txn.copy()  # copy of transaction
 
         if tx.chain == "THOR":
             self.reserve += 100000000
@@ -644,7 +1084,7 @@ class ThorchainState:
             ],
         )
         if pending_txid:
-            event.attributes.append({f"{RUNE.get_chain()}_txid": pending_txid})
+            event.add_attribute({f"{RUNE.get_chain()}_txid": pending_txid})
         self.events.append(event)
 
         return []
@@ -820,7 +1260,7 @@ class ThorchainState:
 
             # here we copy the txn to break references cause
             # the tx is split in 2 events and gas is handled only once
-            in_txn = deepcopy(txn)
+            in_txn = txn.copy()
 
             # generate first swap "fake" outbound event
             out_txn = Transaction(
@@ -972,7 +1412,7 @@ class ThorchainState:
         if emit == 0:
             return Coin(asset, emit), 0, 0, 0, pool
 
-        newPool = deepcopy(pool)  # copy of pool
+        newPool = pool.copy()  # copy of pool balances
         if coin.is_rune():
             newPool.add(x, 0)
             newPool.sub(0, emit)
@@ -984,6 +1424,76 @@ class ThorchainState:
 
         return emit, liquidity_fee, liquidity_fee_in_rune, trade_slip, newPool
 
+    def quote_swaps(self, amounts, source, target):
+        """
+        Quote swaps of many amounts of source asset into target asset against
+        the current pools, without changing any state. Amounts are kept as
+        python integers (object arrays) so results are exactly the ones of
+        the swap method.
+
+        :param list amounts: amounts of source asset to swap
+        :param Asset source: asset sent to swap
+        :param Asset target: target asset
+        :returns: list of one tuple of arrays per pool swapped through,
+            two for a double swap, the final emission is the first array of
+            the last tuple
+            - emit (array) - number of coins to be emitted for the swap
+            - liquidity_fee (array) - liquidity fee
+            - liquidity_fee_in_rune (array) - liquidity fee in rune
+            - trade_slip (array) - trade slip
+
+        """
+        source = Asset(source)
+        target = Asset(target)
+        # python integers, numpy ones would overflow in the pool math
+        x = np.array([int(a) for a in amounts], dtype=object)
+
+        legs = []
+        if not source.is_rune() and not target.is_rune():
+            # its a double swap, the rune emitted is swapped to target
+            legs.append(self._quote_swap(x, source, False))
+            x = legs[0][0]
+            source = RUNE
+
+        if source.is_rune():
+            legs.append(self._quote_swap(x, target, True))
+        else:
+            legs.append(self._quote_swap(x, source, False))
+        return legs
+
+    def _quote_swap(self, x, asset, rune_in):
+        """
+        Quote a swap of an array of amounts through the pool of given asset
+        """
+        pool = self.get_pool(asset)
+        if rune_in:
+            X = pool.rune_balance
+            Y = pool.asset_balance
+        else:
+            X = pool.asset_balance
+            Y = pool.rune_balance
+
+        emit = calc_asset_emission(X, x, Y)
+        liquidity_fee = calc_liquidity_fee(X, x, Y)
+        liquidity_fee_in_rune = liquidity_fee
+        if rune_in:
+            if pool.rune_balance == 0 or pool.asset_balance == 0:
+                liquidity_fee_in_rune = np.zeros_like(liquidity_fee)
+            else:
+                liquidity_fee_in_rune = div_round_array(
+                    liquidity_fee * pool.rune_balance, pool.asset_balance
+                )
+        trade_slip = div_round_array(10000 * x * (2 * X + x), X * X)
+
+        # if we emit zero, nothing else is charged
+        emitted = emit != 0
+        return (
+            emit,
+            np.where(emitted, liquidity_fee, 0),
+            np.where(emitted, liquidity_fee_in_rune, 0),
+            np.where(emitted, trade_slip, 0),
+        )
+
     def _calc_liquidity_fee(self, X, x, Y):
         """
         Calculate the liquidity fee from a trade
@@ -995,7 +1505,7 @@ class ThorchainState:
         :returns: (int) liquidity fee
 
         """
-        return int(float((x ** 2) * Y) / float((x + X) ** 2))
+        return calc_liquidity_fee(X, x, Y)
 
     def _calc_trade_slip(self, X, x):
         """
@@ -1008,8 +1518,7 @@ class ThorchainState:
         :returns: (int) trade slip
 
         """
-        trade_slip = 10000 * (x * (2 * X + x) / (X ** 2))
-        return int(round(trade_slip))
+        return calc_trade_slip(X, x)
 
     def _calc_asset_emission(self, X, x, Y):
         """
@@ -1022,53 +1531,205 @@ class ThorchainState:
         :returns: (int) asset emission
 
         """
-        return int((x * X * Y) / (x + X) ** 2)
+        return calc_asset_emission(X, x, Y)
 
 
 class Event(Jsonable):
     """
     Event class representing events generated by thorchain
     using tendermint sdk events
+
+    Attributes are stored as a tuple of stringified values next to an
+    interned tuple of keys, events built with the same keys share the same
+    key to index map (up to max_layouts distinct keys).
     """
 
+    __slots__ = (
+        "type",
+        "_keys",
+        "_index",
+        "_values",
+        "_canonical_key",
+        "_sort_key",
+        "block_height",
+        "category",
+    )
+
+    # key to index maps by tuple of attribute keys
+    _layouts = {}
+    max_layouts = 1000
+
     def __init__(
         self, event_type, attributes, block_height=None, category=None,
     ):
-        self.type = event_type
-        for attr in attributes:
-            for key, value in attr.items():
-                attr[key] = str(value)
+        self.type = sys.intern(str(event_type))
         self.attributes = attributes
         self.block_height = block_height
         self.category = category
 
+    @property
+    def attributes(self):
+        """
+        List of single key dicts view of the attributes
+        """
+        return [{k: v} for k, v in zip(self._keys, self._values)]
+
+    @attributes.setter
+    def attributes(self, attributes):
+        keys = []
+        values = []
+        for attr in attributes:
+            for key, value in attr.items():
+                keys.append(key)
+                values.append(str(value))
+        self._set_attributes(tuple(keys), tuple(values))
+
+    @property
+    def __dict__(self):
+        """
+        Same fields as before events had slots, used by json exports
+        """
+        return {
+            "type": self.type,
+            "attributes": self.attributes,
+            "block_height": self.block_height,
+            "category": self.category,
+        }
+
+    def _set_attributes(self, keys, values, shared=True):
+        layout = Event._layouts.get(keys) if shared else None
+        if layout is None:
+            keys = tuple(sys.intern(str(k)) for k in keys)
+            index = {}
+            for i, key in enumerate(keys):
+                index.setdefault(key, i)
+            layout = (keys, index)
+            if shared and len(Event._layouts) < Event.max_layouts:
+                Event._layouts[keys] = layout
+        self._keys, self._index = layout
+        self._values = values
+        self._canonical_key = None
+        self._sort_key = None
+
+    @property
+    def canonical_key(self):
+        """
+        Identity of the event: its type and attributes sorted with upper cased
+        values, ignoring outbound ids that the simulator can't know.
+        Computed once and reset when attributes change.
+        """
+        if self._canonical_key is None:
+            self._canonicalize()
+        return self._canonical_key
+
+    @property
+    def sort_key(self):
+        """
+        Order events by type then by the hash of their canonical attributes
+        """
+        if self._sort_key is None:
+            self._canonicalize()
+        return self._sort_key
+
+    def _canonicalize(self):
+        pairs = zip(self._keys, self._values)
+        if self.type == "outbound":
+            pairs = [(k, v) for k, v in pairs if k != "id"]
+        attrs = tuple(sorted((k, v.upper()) for k, v in pairs))
+        self._canonical_key = (self.type, attrs)
+        self._sort_key = (self.type, hash(attrs))
+
+    def add_attribute(self, attr):
+        """
+        Append attributes given as a dict,
+        the event keeps its own key index instead of a shared one
+        """
+        keys = self._keys + tuple(attr.keys())
+        values = self._values + tuple(str(v) for v in attr.values())
+        self._set_attributes(keys, values, shared=False)
+
     def __str__(self):
         attrs = " ".join(map(str, self.attributes))
         return f"Event {self.type} | {attrs}"
 
     def __hash__(self):
-        attrs = sorted(self.attributes, key=lambda x: sorted(x.items()))
-        for attr in attrs:
-            for key, value in attr.items():
-                attr[key] = value.upper()
-        if self.type == "outbound":
-            attrs = [a for a in attrs if list(a.keys())[0] != "id"]
-        return hash(str(attrs))
+        return self.sort_key[1]
 
     def __repr__(self):
         return str(self)
 
     def __eq__(self, other):
-        return (self.type, hash(self)) == (other.type, hash(other))
+        return self.canonical_key == other.canonical_key
 
     def __lt__(self, other):
-        return (self.type, hash(self)) < (other.type, hash(other))
+        return self.sort_key < other.sort_key
 
     def get(self, attr):
-        for a in self.attributes:
-            if list(a.keys())[0] == attr:
-                return a[attr]
-        return None
+        i = self._index.get(attr)
+        if i is None:
+            return None
+        return self._values[i]
+
+
+class EventReconciler:
+    """
+    Incrementally reconcile real thorchain events against simulated ones.
+    Keeps the multiset difference of both sides keyed by canonical event key,
+    with the unmatched events of the side in excess for each key.
+    """
+
+    def __init__(self):
+        self.real_cursor = 0
+        self.sim_cursor = 0
+        self._pending = {}
+
+    def sync(self, real_events, sim_events):
+        """
+        Absorb events appended to the given lists since the last sync
+        """
+        self.add_real(real_events[self.real_cursor :])
+        self.real_cursor = len(real_events)
+        self.add_sim(sim_events[self.sim_cursor :])
+        self.sim_cursor = len(sim_events)
+
+    def add_real(self, events):
+        for event in events:
+            self._add(event, "real")
+
+    def add_sim(self, events):
+        for event in events:
+            self._add(event, "sim")
+
+    def _add(self, event, side):
+        key = event.canonical_key
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = (side, [event])
+        elif pending[0] == side:
+            pending[1].append(event)
+        else:
+            pending[1].pop()
+            if not pending[1]:
+                del self._pending[key]
+
+    def is_matched(self):
+        """
+        Check every real event has a matching simulated event and vice versa
+        """
+        return not self._pending
+
+    def unmatched(self):
+        """
+        Returns unmatched real events and unmatched simulated events
+        """
+        real = []
+        sim = []
+        for side, events in self._pending.values():
+            if side == "real":
+                real.extend(events)
+            else:
+                sim.extend(events)
+        return real, sim
 
 
 class Pool(Jsonable):
@@ -1079,7 +1740,7 @@ class Pool(Jsonable):
         self.rune_balance = rune_amt
         self.asset_balance = asset_amt
         self.total_units = 0
-        self.stakers = []
+        self.stakers = {}
         self.status = status
 
     def get_asset_in_rune(self, val):
@@ -1109,6 +1770,15 @@ class Pool(Jsonable):
 
         return self.get_rune_in_asset(100000000)
 
+    def copy(self):
+        """
+        Copy pool balances and units, stakers are shared with this pool
+        """
+        pool = Pool(self.asset, self.rune_balance, self.asset_balance, self.status)
+        pool.total_units = self.total_units
+        pool.stakers = self.stakers
+        return pool
+
     def sub(self, rune_amt, asset_amt):
         """
         Subtracts from pool
@@ -1137,22 +1807,16 @@ class Pool(Jsonable):
         """
         Fetch a specific staker by address
         """
-        for staker in self.stakers:
-            if staker.address == address:
-                return staker
+        if address in self.stakers:
+            return self.stakers[address]
 
         return Staker(address)
 
     def set_staker(self, staker):
         """
-        Set a staker
+        Set a staker, stakers are keyed by address and keep their insertion order
         """
-        for i, s in enumerate(self.stakers):
-            if s.address == staker.address:
-                self.stakers[i] = staker
-                return
-
-        self.stakers.append(staker)
+        self.stakers[staker.address] = staker
 
     def stake(self, address, rune_amt, asset_amt, asset, txid):
         """
@@ -1208,16 +1872,7 @@ class Pool(Jsonable):
         r = staked rune
         a = staked asset
         """
-        P = self.total_units
-        R = float(R)
-        A = float(A)
-        r = float(r)
-        a = float(a)
-        if R == 0.0 or A == 0.0:
-            return int(r)
-        slipAdjustment = (1 - abs((R * a - r * A)/((2 * r + R) * (a + A))))
-        units = (P * (a * R + A * r))/(2 * A * R)
-        return int(units * slipAdjustment)
+        return calc_stake_units(self.total_units, R, A, r, a)
 
     def _calc_unstake_units(self, staker_units, withdraw_basis_points):
         """
@@ -1233,6 +1888,13 @@ class Pool(Jsonable):
             raise Exception("Overdrawn staker units")
         return units_to_claim, withdraw_rune, withdraw_asset
 
+    def to_json(self):
+        """
+        Export stakers as a list in insertion order
+        """
+        pool = dict(self.__dict__, stakers=list(self.stakers.values()))
+        return json.dumps(pool, default=lambda x: x.__dict__)
+
     def __repr__(self):
         return "<Pool %s Rune: %d | Asset: %d>" % (
             self.asset,
@@ -0,0 +1,104 @@
+"""
+Integer implementation of the thorchain pool math.
+
+Every function works on python integers only, results are exact and do not
+depend on the global Decimal context or float rounding.
+"""
+
+
+def div_round(num, den):
+    """
+    Divide num by den rounding half to even,
+    same as round() on the exact quotient
+    """
+    if den < 0:
+        num, den = -num, -den
+    quotient, remainder = divmod(num, den)
+    remainder *= 2
+    if remainder > den or (remainder == den and quotient & 1):
+        quotient += 1
+    return quotient
+
+
+def div_round_array(nums, den):
+    """
+    Same as div_round for a numpy array of python integers (object dtype)
+    divided by a positive integer
+    """
+    quotient = nums // den
+    remainder = (nums - quotient * den) * 2
+    return quotient + (
+        (remainder > den) | ((remainder == den) & (quotient % 2 == 1))
+    )
+
+
+def get_share(part, total, alloc):
+    """
+    Calculates the share of something
+    (Allocation / (Total / part))
+    """
+    if total == 0 or part == 0:
+        return 0
+    return div_round(alloc * part, total)
+
+
+def calc_asset_emission(X, x, Y):
+    """
+    Calculates the amount of coins to be emitted in a swap
+    ( x * X * Y ) / ( x + X )^2
+
+    :param int X: first balance
+    :param int x: asset amount
+    :param int Y: second balance
+    :returns: (int) asset emission
+
+    """
+    return (x * X * Y) // (x + X) ** 2
+
+
+def calc_liquidity_fee(X, x, Y):
+    """
+    Calculate the liquidity fee from a trade
+    ( x^2 *  Y ) / ( x + X )^2
+
+    :param int X: first balance
+    :param int x: asset amount
+    :param int Y: second balance
+    :returns: (int) liquidity fee
+
+    """
+    return (x * x * Y) // (x + X) ** 2
+
+
+def calc_trade_slip(X, x):
+    """
+    Calculate the trade slip from a trade
+    expressed in basis points (10,000)
+    x * (2*X + x) / (X * X)
+
+    :param int X: first balance
+    :param int x: asset amount
+    :returns: (int) trade slip
+
+    """
+    return div_round(10000 * x * (2 * X + x), X * X)
+
+
+def calc_stake_units(P, R, A, r, a):
+    """
+    Calculate staker units
+    slipAdjustment = (1 - ABS((R a - r A)/((2 r + R) (a + A))))
+    units = ((P (a R + A r))/(2 A R))*slidAdjustment
+    P = pool units
+    R = pool rune balance
+    A = pool asset balance
+    r = staked rune
+    a = staked asset
+    """
+    if R == 0 or A == 0:
+        return r
+    Ra = R * a
+    rA = r * A
+    slip_den = (2 * r + R) * (a + A)
+    slip_num = slip_den - (Ra - rA if Ra > rA else rA - Ra)
+    return (P * (Ra + rA) * slip_num) // (2 * A * R * slip_den)
@@ -35,7 +35,7 @@ class Breakpoint:
             for coin in acct.balances:
                 snap[name][str(coin.asset)] = coin.amount
 
-        for pool in self.thorchain.pools:
+        for pool in self.thorchain.pools.values():
             snap["POOL." + str(pool.asset)] = {
                 str(pool.asset): int(pool.asset_balance),
                 RUNE: int(pool.rune_balance),
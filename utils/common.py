@@ -1,13 +1,27 @@
+import asyncio
+import aiohttp
 import requests
 import logging
 import json
 import os
 import hashlib
+import random
+import threading
+import time
 
-from decimal import Decimal, getcontext
+from copy import copy
+from decimal import Decimal
+from urllib.parse import urlparse
 
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
+from requests.packages.urllib3.exceptions import MaxRetryError, ResponseError
+from requests.packages.urllib3.connectionpool import (
+    HTTPConnectionPool,
+    HTTPSConnectionPool,
+)
+
+from utils.amm import get_share  # noqa: F401
 
 DEFAULT_RUNE_ASSET = "BNB.RUNE-67C"
 
@@ -16,44 +30,422 @@ def get_rune_asset():
     return Asset(os.environ.get("RUNE", DEFAULT_RUNE_ASSET))
 
 
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Request refused without being sent because the circuit of its host is open
+    """
+
+
+class RetryPolicy:
+    """
+    Retry and circuit breaker policy of an http session.
+
+    Every attempt is bounded by timeout seconds. Failed attempts are retried
+    with full jitter exponential backoff (capped at backoff_max) until the
+    retries are exhausted or deadline seconds passed since the request
+    started, so a call never takes much longer than deadline + timeout.
+
+    A host failing failure_threshold requests in a row trips its circuit:
+    requests to it fail fast with CircuitOpenError for reset_timeout seconds,
+    then the next failure trips it again and a success closes it.
+    Clients of a host share its policy, see get_policy.
+    """
+
+    def __init__(
+        self,
+        retries=6,
+        backoff_factor=1,
+        backoff_max=10,
+        status_forcelist=(500, 502, 504),
+        timeout=30,
+        deadline=60,
+        failure_threshold=5,
+        reset_timeout=10,
+    ):
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.status_forcelist = status_forcelist
+        self.timeout = timeout
+        self.deadline = deadline
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retried = 0
+        self.trips = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._circuits = {}
+        self._local = threading.local()
+
+    def make_retry(self):
+        return PolicyRetry(
+            total=self.retries,
+            read=self.retries,
+            connect=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.status_forcelist,
+            policy=self,
+        )
+
+    def get_stats(self):
+        return {"retries": self.retried, "trips": self.trips, "rejected": self.rejected}
+
+    def retrying(self):
+        """
+        Record a retry of the current request
+        """
+        with self._lock:
+            self.retried += 1
+
+    def start(self, host):
+        """
+        Start a request to host, raises CircuitOpenError if its circuit is open
+        """
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is not None and circuit[1] is not None:
+                if time.monotonic() - circuit[1] < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"circuit open for {host}")
+                # half open, the next failure trips it again
+                circuit[0] = self.failure_threshold - 1
+                circuit[1] = None
+        self._local.started = time.monotonic()
+
+    def finish(self, host, ok):
+        """
+        Record the outcome of a request to host
+        """
+        with self._lock:
+            if ok:
+                self._circuits.pop(host, None)
+                return
+            circuit = self._circuits.setdefault(host, [0, None])
+            circuit[0] += 1
+            if circuit[0] >= self.failure_threshold and circuit[1] is None:
+                logging.warning(f"circuit open for {host}")
+                circuit[1] = time.monotonic()
+                self.trips += 1
+
+    def remaining(self):
+        """
+        Seconds left before the deadline of the current thread request
+        """
+        started = getattr(self._local, "started", None)
+        if started is None or self.deadline is None:
+            return None
+        return self.deadline - (time.monotonic() - started)
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def get_policy(url):
+    """
+    Get the RetryPolicy shared by every client of the host of url,
+    so their failures trip one circuit and count against one budget
+    """
+    host = urlparse(url).netloc
+    with _policies_lock:
+        policy = _policies.get(host)
+        if policy is None:
+            policy = _policies[host] = RetryPolicy()
+        return policy
+
+
+class RpcErrorResponse(ResponseError):
+    """
+    Json rpc error answered with a retryable status, the host is up
+    and would answer the same so it is neither retried nor a host failure
+    """
+
+
+def is_rpc_error(headers, content):
+    """
+    Check if a response body is a json rpc error
+    """
+    if "json" not in headers.get("Content-Type", ""):
+        return False
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return False
+    return isinstance(body, dict) and body.get("error") is not None
+
+
+class PolicyRetry(Retry):
+    """
+    urllib3 Retry with jittered backoff bounded by the deadline of its policy
+    """
+
+    def __init__(self, *args, policy=None, **kwargs):
+        self.policy = policy
+        super().__init__(*args, **kwargs)
+
+    def new(self, **kwargs):
+        kwargs.setdefault("policy", self.policy)
+        return super().new(**kwargs)
+
+    def increment(self, method=None, url=None, response=None, error=None, **kwargs):
+        if response is not None and is_rpc_error(response.headers, response.data):
+            reason = RpcErrorResponse(response.data.decode(errors="replace"))
+            raise MaxRetryError(kwargs.get("_pool"), url, reason)
+        retry = super().increment(method, url, response, error, **kwargs)
+        remaining = self.policy.remaining()
+        if remaining is not None and remaining <= 0:
+            reason = error or ResponseError("retry deadline exceeded")
+            raise MaxRetryError(kwargs.get("_pool"), url, reason)
+        self.policy.retrying()
+        return retry
+
+    def get_backoff_time(self):
+        backoff = random.uniform(
+            0, min(super().get_backoff_time(), self.policy.backoff_max)
+        )
+        remaining = self.policy.remaining()
+        if remaining is not None:
+            backoff = max(0, min(backoff, remaining))
+        return backoff
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter counting the connections it opens and the requests it
+    sends over them, applying the timeout and circuit breaker of its policy
+    """
+
+    def __init__(self, *args, policy=None, **kwargs):
+        self.opened = 0
+        self.requests = 0
+        self.policy = policy or RetryPolicy()
+        kwargs.setdefault("max_retries", self.policy.make_retry())
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.policy.timeout
+        host = urlparse(request.url).netloc
+        self.policy.start(host)
+        try:
+            resp = super().send(request, timeout=timeout, **kwargs)
+        except requests.RequestException as e:
+            reason = getattr(e.args[0] if e.args else None, "reason", None)
+            self.policy.finish(host, isinstance(reason, RpcErrorResponse))
+            raise
+        ok = resp.status_code < 500
+        if not ok and not kwargs.get("stream"):
+            ok = is_rpc_error(resp.headers, resp.content)
+        self.policy.finish(host, ok)
+        return resp
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": self._counting(HTTPConnectionPool),
+            "https": self._counting(HTTPSConnectionPool),
+        }
+
+    def _counting(self, pool_cls):
+        adapter = self
+
+        class Connection(pool_cls.ConnectionCls):
+            def connect(self):
+                adapter.opened += 1
+                return super().connect()
+
+        class Pool(pool_cls):
+            ConnectionCls = Connection
+
+            def _make_request(self, *args, **kwargs):
+                adapter.requests += 1
+                return super()._make_request(*args, **kwargs)
+
+        return Pool
+
+
 def requests_retry_session(
-    retries=6, backoff_factor=1, status_forcelist=(500, 502, 504), session=None,
+    retries=6,
+    backoff_factor=1,
+    status_forcelist=(500, 502, 504),
+    session=None,
+    pool_connections=10,
+    pool_maxsize=10,
+    policy=None,
 ):
     """
-    Creates a request session that has auto retry
+    Creates a request session that has auto retry, keeping up to
+    pool_maxsize connections alive for each of pool_connections hosts.
+    Retries, timeouts and circuit breaking follow the given RetryPolicy,
+    or one built from retries, backoff_factor and status_forcelist.
     """
     session = session or requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
+    policy = policy or RetryPolicy(
+        retries=retries,
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = PooledHTTPAdapter(
+        policy=policy, pool_connections=pool_connections, pool_maxsize=pool_maxsize
+    )
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     return session
 
 
-def get_share(part, total, alloc):
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls into one.
+
+    The first call for a key runs the function, calls for the same key made
+    while it runs (or up to window seconds after it returned) wait for it and
+    share its result. Shared results must be treated as read only.
+    """
+
+    class Flight:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.finished = None
+
+    def __init__(self, window=0):
+        self.window = window
+        self.calls = 0
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def _live(self, finished):
+        return finished is None or time.monotonic() - finished <= self.window
+
+    def do(self, key, func, *args):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None or not self._live(flight.finished)
+            if leader:
+                flight = self._flights[key] = self.Flight()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if leader:
+            try:
+                flight.result = func(*args)
+            except Exception as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    flight.finished = time.monotonic()
+                    expired = self.window <= 0 or flight.error is not None
+                    if expired and self._flights.get(key) is flight:
+                        del self._flights[key]
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+
+class AsyncSingleFlight:
     """
-    Calculates the share of something
-    (Allocation / (Total / part))
+    SingleFlight for coroutine functions running in one event loop.
+
+    The shared call runs as a task so a cancelled caller doesn't cancel it
+    for the others. Shared results must be treated as read only.
     """
-    if total == 0 or part == 0:
-        return 0
-    getcontext().prec = 18
-    return int(round(Decimal(alloc) / (Decimal(total) / Decimal(part))))
+
+    def __init__(self, window=0):
+        self.window = window
+        self.calls = 0
+        self.shared = 0
+        self._flights = {}
+
+    def _live(self, finished):
+        return finished is None or time.monotonic() - finished <= self.window
+
+    async def do(self, key, func, *args):
+        entry = self._flights.get(key)
+        if entry is not None and self._live(entry[1]):
+            self.shared += 1
+            return await asyncio.shield(entry[0])
+
+        self.calls += 1
+        task = asyncio.ensure_future(func(*args))
+        entry = self._flights[key] = [task, None]
+
+        def done(task):
+            entry[1] = time.monotonic()
+            failed = task.cancelled() or task.exception() is not None
+            if (self.window <= 0 or failed) and self._flights.get(key) is entry:
+                del self._flights[key]
+
+        task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+
+class ResponseBody:
+    """
+    Json body of a response shared by the callers of coalesced and
+    not modified gets. It is parsed once for the callers reading it
+    (shared, read only) and parsed again for each caller wanting its own
+    copy: decoding the text is cheaper than deep copying the parsed body.
+    """
+
+    __slots__ = ("text", "_data")
+
+    def __init__(self, text):
+        self.text = text
+        self._data = None
+
+    def shared(self):
+        if self._data is None:
+            self._data = json.loads(self.text)
+        return self._data
+
+    def copy(self):
+        return json.loads(self.text)
 
 
 class HttpClient:
     """
     An generic http client
+
+    Every request of a client goes through one long lived session,
+    so connections are kept alive and reused between requests.
+    Identical concurrent gets are coalesced into one request, see SingleFlight.
+
+    With conditional gets, the ETag and Last-Modified validators of each
+    response are kept with its body and sent back with the next get of the
+    same url, a 304 Not Modified answer is served from that body.
+
+    fetch gives every caller its own copy of the body, decoded again from
+    the kept text, so a 304 saves the transfer but not the decoding. Read
+    only callers pass copy=False to share the body parsed once instead.
     """
 
-    def __init__(self, base_url):
+    def __init__(
+        self,
+        base_url,
+        pool_size=10,
+        keep_alive=True,
+        coalesce_window=0,
+        conditional=True,
+        policy=None,
+    ):
         self.base_url = base_url
+        self.policy = policy or get_policy(base_url)
+        self.session = requests_retry_session(
+            pool_maxsize=pool_size, policy=self.policy
+        )
+        self.flights = SingleFlight(coalesce_window)
+        self.conditional = conditional
+        self.not_modified = 0
+        self._validated = {}
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
 
     def get_url(self, path):
         """
@@ -61,28 +453,178 @@ class HttpClient:
         """
         return self.base_url + path
 
-    def fetch(self, path, args={}):
+    def get_connection_stats(self):
+        """
+        Number of connections opened and of requests that reused
+        an already opened connection
+        """
+        adapters = set(self.session.adapters.values())
+        opened = sum(adapter.opened for adapter in adapters)
+        requests = sum(adapter.requests for adapter in adapters)
+        return {"opened": opened, "reused": requests - opened}
+
+    def get_retry_stats(self):
+        """
+        Number of retries, circuit trips and requests refused by an open circuit
+        """
+        return self.policy.get_stats()
+
+    def fetch(self, path, args={}, copy=True):
         """
         Make a get request
+
+        :param bool copy: get a copy of the body free to modify,
+            otherwise the body shared with other callers, read only
         """
         url = self.get_url(path)
-        resp = requests_retry_session().get(url, params=args)
+        key = (url, json.dumps(args, sort_keys=True))
+        body = self.flights.do(key, self._get, key, url, args)
+        return body.copy() if copy else body.shared()
+
+    def _get(self, key, url, args):
+        headers = {}
+        cached = self._validated.get(key) if self.conditional else None
+        if cached is not None:
+            etag, last_modified, body = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        resp = self.session.get(url, params=args, headers=headers)
+        if resp.status_code == 304 and cached is not None:
+            self.not_modified += 1
+            return body
         resp.raise_for_status()
-        return resp.json()
+        body = ResponseBody(resp.text)
+
+        if self.conditional:
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+            if etag or last_modified:
+                self._validated[key] = (etag, last_modified, body)
+            else:
+                self._validated.pop(key, None)
+        return body
 
     def post(self, path, payload={}):
         """
         Make a post request
         """
         url = self.get_url(path)
-        resp = requests_retry_session().post(url, json=payload)
+        resp = self.session.post(url, json=payload)
         if resp.status_code != 200:
             logging.error(resp.text)
         resp.raise_for_status()
         return json.loads(resp.text, parse_float=Decimal)
 
 
+class AsyncHttpClient:
+    """
+    An asyncio http client, same methods as HttpClient as coroutines.
+
+    Requests share one session with a pooled keep alive connector of up to
+    limit connections, use the client as an async context manager or await
+    close() when done. Failed connections and status_forcelist responses are
+    retried with exponential backoff like requests_retry_session.
+    Identical concurrent gets are coalesced into one request, fetch copies
+    the body like HttpClient.fetch.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        limit=100,
+        retries=6,
+        backoff_factor=1,
+        status_forcelist=(500, 502, 504),
+        coalesce_window=0,
+    ):
+        self.base_url = base_url
+        self.limit = limit
+        self.flights = AsyncSingleFlight(coalesce_window)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = status_forcelist
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    @property
+    def session(self):
+        """
+        Shared client session, created on first use in the running loop
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def get_url(self, path):
+        """
+        Get fully qualified url with given path
+        """
+        return self.base_url + path
+
+    async def request(self, method, path, **kwargs):
+        """
+        Make a request, retrying connection errors and retryable statuses
+        """
+        url = self.get_url(path)
+        for attempt in range(self.retries + 1):
+            if attempt > 1:
+                await asyncio.sleep(self.backoff_factor * 2 ** (attempt - 1))
+            try:
+                resp = await self.session.request(method, url, **kwargs)
+            except aiohttp.ClientConnectionError:
+                if attempt == self.retries:
+                    raise
+                continue
+            if resp.status in self.status_forcelist and attempt < self.retries:
+                resp.release()
+                continue
+            return resp
+
+    async def fetch(self, path, args={}, copy=True):
+        """
+        Make a get request
+
+        :param bool copy: get a copy of the body free to modify,
+            otherwise the body shared with other callers, read only
+        """
+        key = (path, json.dumps(args, sort_keys=True))
+        body = await self.flights.do(key, self._get, path, args)
+        return body.copy() if copy else body.shared()
+
+    async def _get(self, path, args):
+        async with await self.request("GET", path, params=args) as resp:
+            resp.raise_for_status()
+            return ResponseBody(await resp.text())
+
+    async def post(self, path, payload={}):
+        """
+        Make a post request
+        """
+        async with await self.request("POST", path, json=payload) as resp:
+            text = await resp.text()
+            if resp.status != 200:
+                logging.error(text)
+            resp.raise_for_status()
+            return json.loads(text, parse_float=Decimal)
+
+
 class Jsonable:
+    __slots__ = ()
+
     def to_json(self):
         return json.dumps(self, default=lambda x: x.__dict__)
 
@@ -270,6 +812,18 @@ class Transaction(Jsonable):
         other_coins = other.coins or []
         return sorted(coins) < sorted(other_coins)
 
+    def copy(self):
+        """
+        Copy the transaction with its own coins and gas,
+        the only fields mutated while thorchain handles it
+        """
+        txn = copy(self)
+        if self.coins:
+            txn.coins = [Coin(c.asset, c.amount) for c in self.coins]
+        if self.gas:
+            txn.gas = [Coin(g.asset, g.amount) for g in self.gas]
+        return txn
+
     def get_asset_from_memo(self):
         parts = self.memo.split(":")
         if len(parts) >= 2 and parts[1] != "":